@@ -11,6 +11,7 @@ reserved = (
     "NIL",
     "LAMBDA",
     "REF",
+    "INCLUDE",
 )
 
 reserved_map = {}
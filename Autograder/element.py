@@ -5,6 +5,10 @@ class Element:
         for key, value in kwargs.items():
             self.dict[key] = value
 
+    # AST nodes are never mutated once parsed, so copies of runtime values can share them
+    def __deepcopy__(self, memo):
+        return self
+
     def get(self, key):
         if key not in self.dict:
             return None
@@ -26,4 +30,4 @@ class Element:
             if len(s) > 0:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
-        return str(v)
+        return str(v)
\ No newline at end of file
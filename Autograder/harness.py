@@ -5,6 +5,8 @@ test management.
 
 import asyncio
 import json
+import statistics
+import time
 from os import makedirs
 from os.path import exists
 from abc import ABC, abstractmethod
@@ -32,40 +34,103 @@ def run_test(scaffold, test_case):
         return 0
 
 
-async def run_test_wrapper(interpreter, test_case, timeout):
+def timed_run_test(scaffold, test_case):
+    """Run a single test case; returns (score, wall time, CPU time) with times in seconds."""
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    score = run_test(scaffold, test_case)
+    return score, time.perf_counter() - wall_start, time.thread_time() - cpu_start
+
+
+def summarize_timing(wall_times, cpu_times):
+    """Timing entry for one test: min and median over the runs, plus every run."""
+    return {
+        "runs": len(wall_times),
+        "wall_time": statistics.median(wall_times),
+        "wall_time_min": min(wall_times),
+        "cpu_time": statistics.median(cpu_times),
+        "cpu_time_min": min(cpu_times),
+        "wall_times": wall_times,
+        "cpu_times": cpu_times,
+    }
+
+
+async def run_test_wrapper(interpreter, test_case, timeout, repeats=1):
     """
-    Wrapper for run_test with timeout and minor debugging.
+    Wrapper for run_test with timeout and minor debugging; runs the test up to
+    repeats times (stopping at the first failure) and returns (score, timing).
     Uses asyncio to enforce timeout, not for concurrency.
     """
     print(f'Running {test_case["srcfile"]}... ', end="")
-    try:
-        async with asyncio.timeout(timeout):
-            result = await asyncio.to_thread(run_test, interpreter, test_case)
-            print(f' {"PASSED" if result else "FAILED"}')
-            return result
-    except asyncio.TimeoutError:
-        print("TIMED OUT")
-        return 0
-
-
-async def run_all_tests(interpreter, tests, timeout_per_test=5):
+    wall_times = []
+    cpu_times = []
+    result = 0
+    for _ in range(repeats):
+        try:
+            async with asyncio.timeout(timeout):
+                result, wall_time, cpu_time = await asyncio.to_thread(
+                    timed_run_test, interpreter, test_case
+                )
+        except asyncio.TimeoutError:
+            print("TIMED OUT")
+            # the CPU time of a test that timed out is unknown
+            return 0, summarize_timing([timeout], [timeout])
+        wall_times.append(wall_time)
+        cpu_times.append(cpu_time)
+        if not result:
+            break
+    timing = summarize_timing(wall_times, cpu_times)
+    print(f' {"PASSED" if result else "FAILED"} ({timing["wall_time"] * 1000:.1f} ms)')
+    return result, timing
+
+
+def format_slowest(results, count):
+    """Lines listing the count slowest tests by median wall time."""
+    slowest = sorted(
+        results, key=lambda result: result["extra_data"]["wall_time"], reverse=True
+    )[:count]
+    lines = [f"Slowest {len(slowest)} tests:"]
+    for result in slowest:
+        timing = result["extra_data"]
+        lines.append(
+            f'  {timing["wall_time"] * 1000:9.1f} ms wall {timing["cpu_time"] * 1000:9.1f} ms CPU  '
+            f'{result["name"]}'
+        )
+    return lines
+
+
+async def run_all_tests(
+    interpreter, tests, timeout_per_test=5, repeats=1, slowest=10, check_results=None
+):
     """
     Run all tests sequentially; defaults to 5s timeout per test.
-    Each test case *must* have a name and srcfile key.
+    Each test case *must* have a name and srcfile key. Every test is run up to
+    repeats times; its result carries the wall and CPU times under extra_data,
+    and the slowest tests are listed at the end. check_results, if given, is
+    applied to the results (and may fail tests) before the summary is printed.
     """
     print(f"Running {len(tests)} tests...")
-    results = [
-        {
-            "name": test["name"],
-            "score": await run_test_wrapper(interpreter, test, timeout_per_test),
-            "max_score": 1,
-            "visibility": "visible"
-            if test.get("visible", False)
-            else "after_published",
-        }
-        for test in tests
-    ]
+    results = []
+    for test in tests:
+        score, timing = await run_test_wrapper(
+            interpreter, test, timeout_per_test, repeats
+        )
+        results.append(
+            {
+                "name": test["name"],
+                "score": score,
+                "max_score": 1,
+                "visibility": "visible"
+                if test.get("visible", False)
+                else "after_published",
+                "extra_data": timing,
+            }
+        )
+    if check_results is not None:
+        check_results(results)
     print(f"{get_score(results)}/{len(tests)} tests passed.")
+    if slowest and results:
+        print("\n".join(format_slowest(results, slowest)))
     return results
 
 
@@ -73,7 +138,14 @@ def format_gradescope_output(results):
     """Generate proper JSON object depending on results type."""
     if isinstance(results, (int, float)):
         return {"score": results}
-    return {"tests": results}
+    return {
+        "execution_time": sum(
+            result["extra_data"]["wall_time"] * result["extra_data"]["runs"]
+            for result in results
+            if "extra_data" in result
+        ),
+        "tests": results,
+    }
 
 
 def write_gradescope_output(score, is_prod):
@@ -87,6 +159,91 @@ def write_gradescope_output(score, is_prod):
         json.dump(data, handle, ensure_ascii=False, indent=4)
 
 
+def write_bench_output(data, path="bench_results.json"):
+    """Write benchmark results as JSON (to CWD by default)."""
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle, ensure_ascii=False, indent=4)
+
+
+def write_compare_output(data, path="bench_compare.json"):
+    """Write cross-version benchmark results as JSON (to CWD by default)."""
+    write_bench_output(data, path)
+
+
+def load_perf_baseline(path):
+    """Read stored timing baselines ({version: {test name: timing}}); empty if there are none."""
+    if not exists(path):
+        return {}
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def write_perf_baseline(results, version, path):
+    """Store the timings of the passing tests as the baseline for this version."""
+    baseline = load_perf_baseline(path)
+    baseline[version] = {
+        result["name"]: {
+            "wall_time": result["extra_data"]["wall_time"],
+            "mad": statistics.median(
+                abs(wall_time - result["extra_data"]["wall_time"])
+                for wall_time in result["extra_data"]["wall_times"]
+            ),
+            "runs": result["extra_data"]["runs"],
+        }
+        for result in results
+        if result["score"] and "extra_data" in result
+    }
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(baseline, handle, ensure_ascii=False, indent=4)
+
+
+def perf_threshold(timing, tolerance, noise, floor):
+    """
+    Slowest acceptable median wall time against a baseline timing: the baseline
+    median plus the largest of a relative tolerance, noise times the baseline's
+    spread (MAD scaled to a standard deviation) and an absolute floor.
+    """
+    return timing["wall_time"] + max(
+        tolerance * timing["wall_time"], noise * 1.4826 * timing["mad"], floor
+    )
+
+
+def check_perf_regressions(results, baseline, tolerance=0.25, noise=3, floor=0.001):
+    """
+    Compare passing tests against their baselines; tests slower than the threshold
+    become performance failures (score 0, with the reason as output). Returns
+    (name, baseline, current, threshold) for every test with a baseline.
+    """
+    rows = []
+    for result in results:
+        timing = baseline.get(result["name"])
+        if timing is None or not result["score"] or "extra_data" not in result:
+            continue
+        current = result["extra_data"]["wall_time"]
+        threshold = perf_threshold(timing, tolerance, noise, floor)
+        rows.append((result["name"], timing["wall_time"], current, threshold))
+        if current > threshold:
+            result["score"] = 0
+            result["output"] = (
+                f"Performance regression: {current * 1000:.1f} ms against a baseline of "
+                f"{timing['wall_time'] * 1000:.1f} ms (threshold {threshold * 1000:.1f} ms)"
+            )
+    return rows
+
+
+def format_perf_diff(rows):
+    """Lines comparing each test's wall time with its baseline, regressions flagged."""
+    lines = [f"{'baseline ms':>12}{'current ms':>12}{'change':>9}  test"]
+    for name, base, current, threshold in sorted(
+        rows, key=lambda row: row[2] / row[1], reverse=True
+    ):
+        flag = "  <-- performance regression" if current > threshold else ""
+        lines.append(
+            f"{base * 1000:>12.1f}{current * 1000:>12.1f}{(current / base - 1) * 100:>+8.0f}%  {name}{flag}"
+        )
+    return lines
+
+
 def get_score(results):
     """Helper to get student's score (for 0/1-based scores.)"""
     return len(list(filter(lambda result: result["score"], results)))
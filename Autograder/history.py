@@ -0,0 +1,296 @@
+"""
+Local SQLite store of test and benchmark runs, with a small query CLI.
+
+Each tester run adds a row to `runs` (kind, time, version, interpreter source hash) and one
+per test or benchmark to `results` (outcome, wall and CPU time, .br file hash).
+
+usage: python3 history.py [--db PATH] trend TEST [--version V] [--limit N]
+       python3 history.py [--db PATH] movers [--version V] [--kind KIND] [--window N] [--limit N]
+       python3 history.py [--db PATH] pass-rate [--version V] [--kind KIND] [--limit N]
+"""
+
+import argparse
+import hashlib
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import sysconfig
+import types
+from datetime import datetime, timezone
+
+DEFAULT_DB = "results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    version TEXT NOT NULL,
+    interpreter TEXT NOT NULL,
+    interpreter_hash TEXT,
+    python TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    srcfile TEXT NOT NULL,
+    source_hash TEXT,
+    passed INTEGER NOT NULL,
+    wall_time REAL,
+    cpu_time REAL,
+    repeats INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_by_name ON results (name, run_id);
+"""
+
+
+def connect(path=DEFAULT_DB):
+    """Open (creating if needed) the results database."""
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def file_hash(path):
+    """sha256 of a file's contents, or None if it cannot be read."""
+    try:
+        with open(path, "rb") as handle:
+            return hashlib.sha256(handle.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def interpreter_sources(interpreter_lib):
+    """
+    Source files of the interpreter module and of every module it imports, directly
+    or not (parser, lexer, analyses, base classes...), outside the Python installation.
+    """
+    installation = tuple(
+        os.path.realpath(sysconfig.get_paths()[key]) for key in ["stdlib", "platstdlib", "purelib", "platlib"]
+    )
+    sources = {}
+    pending = [interpreter_lib]
+    while pending:
+        module = pending.pop()
+        path = getattr(module, "__file__", None)
+        if module.__name__ in sources or path is None or os.path.realpath(path).startswith(installation):
+            continue
+        sources[module.__name__] = path
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                pending.append(value)
+            elif isinstance(getattr(value, "__module__", None), str) and value.__module__ in sys.modules:
+                pending.append(sys.modules[value.__module__])
+    return sources
+
+
+def interpreter_hash(interpreter_lib):
+    """sha256 over the names and contents of the interpreter's source files (see interpreter_sources)."""
+    digest = hashlib.sha256()
+    for name, path in sorted(interpreter_sources(interpreter_lib).items()):
+        digest.update(name.encode("utf-8"))
+        digest.update((file_hash(path) or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def add_run(connection, kind, version, interpreter_lib, rows):
+    """Append a run and its (name, srcfile, passed, wall_time, cpu_time, repeats) rows; returns the run id."""
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (kind, started_at, version, interpreter, interpreter_hash, python) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                kind,
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                version,
+                interpreter_lib.__name__,
+                interpreter_hash(interpreter_lib),
+                platform.python_version(),
+            ),
+        )
+        run_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO results (run_id, name, srcfile, source_hash, passed, wall_time, cpu_time, repeats) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (run_id, name, srcfile, file_hash(srcfile), passed, wall_time, cpu_time, repeats)
+                for name, srcfile, passed, wall_time, cpu_time, repeats in rows
+            ],
+        )
+    return run_id
+
+
+def record_test_run(path, version, interpreter_lib, tests, results):
+    """Store a tester run: tests are the test cases and results run_all_tests' entries, in the same order."""
+    rows = []
+    for test, result in zip(tests, results):
+        timing = result.get("extra_data", {})
+        rows.append(
+            (
+                result["name"],
+                test["srcfile"],
+                int(bool(result["score"])),
+                timing.get("wall_time"),
+                timing.get("cpu_time"),
+                timing.get("runs"),
+            )
+        )
+    connection = connect(path)
+    try:
+        return add_run(connection, "test", version, interpreter_lib, rows)
+    finally:
+        connection.close()
+
+
+def record_bench_run(path, version, interpreter_lib, results):
+    """Store a benchmark run; the wall time of a benchmark is its median."""
+    rows = [
+        (
+            result["name"],
+            result["srcfile"],
+            int(result["status"] == "ok"),
+            result.get("median"),
+            None,
+            result.get("repeats"),
+        )
+        for result in results
+    ]
+    connection = connect(path)
+    try:
+        return add_run(connection, "bench", version, interpreter_lib, rows)
+    finally:
+        connection.close()
+
+
+def run_filter(version, kind):
+    """WHERE clause (and parameters) restricting runs to a version and kind when given."""
+    clauses = []
+    params = []
+    if version is not None:
+        clauses.append("runs.version = ?")
+        params.append(version)
+    if kind is not None:
+        clauses.append("runs.kind = ?")
+        params.append(kind)
+    return (" AND " + " AND ".join(clauses) if clauses else ""), params
+
+
+def trend(connection, name, version=None, limit=20):
+    """The last limit results of one test, oldest first."""
+    where, params = run_filter(version, None)
+    rows = connection.execute(
+        "SELECT runs.id, runs.started_at, runs.version, runs.interpreter_hash, results.source_hash, "
+        "results.passed, results.wall_time, results.cpu_time FROM results JOIN runs ON runs.id = results.run_id "
+        f"WHERE results.name = ?{where} ORDER BY runs.id DESC LIMIT ?",
+        [name, *params, limit],
+    ).fetchall()
+    return rows[::-1]
+
+
+def movers(connection, version=None, kind="test", window=5, limit=10):
+    """
+    Tests whose wall time in the latest run moved the most against their median
+    over the window runs before it: (name, previous median, latest, ratio).
+    """
+    where, params = run_filter(version, kind)
+    run_ids = [
+        row[0]
+        for row in connection.execute(
+            f"SELECT id FROM runs WHERE 1 = 1{where} ORDER BY id DESC LIMIT ?", [*params, window + 1]
+        )
+    ]
+    if len(run_ids) < 2:
+        return []
+    latest, previous = run_ids[0], run_ids[1:]
+    history = {}
+    for name, run_id, wall_time in connection.execute(
+        f"SELECT name, run_id, wall_time FROM results WHERE run_id IN ({', '.join('?' * len(run_ids))}) "
+        "AND passed AND wall_time > 0",
+        run_ids,
+    ):
+        history.setdefault(name, {})[run_id] = wall_time
+    moved = []
+    for name, times in history.items():
+        before = [times[run_id] for run_id in previous if run_id in times]
+        if latest not in times or not before:
+            continue
+        median = statistics.median(before)
+        moved.append((name, median, times[latest], times[latest] / median))
+    moved.sort(key=lambda row: max(row[3], 1 / row[3]), reverse=True)
+    return moved[:limit]
+
+
+def pass_rates(connection, version=None, kind=None, limit=20):
+    """Per-run pass counts for the last limit runs (oldest first), and tests that both passed and failed."""
+    where, params = run_filter(version, kind)
+    runs = connection.execute(
+        "SELECT runs.id, runs.started_at, runs.kind, runs.version, SUM(results.passed), COUNT(*) "
+        f"FROM runs JOIN results ON runs.id = results.run_id WHERE 1 = 1{where} "
+        "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?",
+        [*params, limit],
+    ).fetchall()[::-1]
+    flaky = connection.execute(
+        "SELECT results.name, SUM(results.passed), COUNT(*) FROM results JOIN runs ON runs.id = results.run_id "
+        f"WHERE 1 = 1{where} GROUP BY results.name "
+        "HAVING SUM(results.passed) > 0 AND SUM(results.passed) < COUNT(*) ORDER BY results.name",
+        params,
+    ).fetchall()
+    return runs, flaky
+
+
+def milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the history of test and benchmark runs")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    trend_parser = commands.add_parser("trend", help="results of one test over time")
+    trend_parser.add_argument("name", help='test name, e.g. "Correctness | test_pmap"')
+    trend_parser.add_argument("--version")
+    trend_parser.add_argument("--limit", type=int, default=20)
+
+    movers_parser = commands.add_parser("movers", help="tests whose time moved most in the latest run")
+    movers_parser.add_argument("--version")
+    movers_parser.add_argument("--kind", default="test", choices=["test", "bench"])
+    movers_parser.add_argument("--window", type=int, default=5, help="earlier runs to compare against")
+    movers_parser.add_argument("--limit", type=int, default=10)
+
+    rate_parser = commands.add_parser("pass-rate", help="pass rate per run and tests that flip")
+    rate_parser.add_argument("--version")
+    rate_parser.add_argument("--kind", choices=["test", "bench"])
+    rate_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    connection = connect(args.db)
+    if args.command == "trend":
+        print(f"{'run':>5}  {'started':<27}{'v':>3}  {'interp':<9}{'source':<9}{'result':<8}{'wall ms':>9}{'cpu ms':>9}")
+        for run_id, started, version, interpreter_hash, source_hash, passed, wall_time, cpu_time in trend(
+            connection, args.name, args.version, args.limit
+        ):
+            print(
+                f"{run_id:>5}  {started:<27}{version:>3}  {(interpreter_hash or '-')[:8]:<9}{(source_hash or '-')[:8]:<9}"
+                f"{'PASSED' if passed else 'FAILED':<8}{milliseconds(wall_time):>9}{milliseconds(cpu_time):>9}"
+            )
+    elif args.command == "movers":
+        print(f"{'before ms':>10}{'latest ms':>11}{'change':>9}  test")
+        for name, before, latest, ratio in movers(connection, args.version, args.kind, args.window, args.limit):
+            print(f"{milliseconds(before):>10}{milliseconds(latest):>11}{(ratio - 1) * 100:>+8.0f}%  {name}")
+    else:
+        runs, flaky = pass_rates(connection, args.version, args.kind, args.limit)
+        print(f"{'run':>5}  {'started':<27}{'kind':<7}{'v':>3}{'passed':>10}{'rate':>8}")
+        for run_id, started, kind, version, passed, total in runs:
+            print(f"{run_id:>5}  {started:<27}{kind:<7}{version:>3}{f'{passed}/{total}':>10}{passed / total:>8.0%}")
+        if flaky:
+            print("\nTests that both passed and failed:")
+            for name, passed, total in flaky:
+                print(f"  {passed}/{total}  {name}")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,17 @@ class ErrorType(Enum):
     # Add others here
 
 
+# A builtin function implemented in Python. arg_types has one entry per parameter: the type or tuple of
+# types the argument must have, or None to accept any value; a variadic builtin takes any number of
+# arguments, each checked against its single entry.
+class Builtin:
+    def __init__(self, name, func, arg_types, variadic=False):
+        self.name = name
+        self.func = func
+        self.arg_types = tuple(t if t is None or isinstance(t, tuple) else (t,) for t in arg_types)
+        self.variadic = variadic
+
+
 class InterpreterBase:
     # AST node types
     PROGRAM_DEF = "program"
@@ -32,11 +43,13 @@ class InterpreterBase:
     VAR_DEF = "var"
     OBJ_DEF = "@"
     NOT_DEF = "!"
+    INCLUDE_DEF = "include"
 
     # methods
     def __init__(self, console_output=True, inp=None):
         self.console_output = console_output
         self.inp = inp  # if not none, then read input from passed-in list
+        self.builtins = {}  # (name, arity) -> Builtin; arity is None for variadic builtins
         self.reset()
 
     # Call to reset I/O for another run of the program
@@ -74,6 +87,19 @@ class InterpreterBase:
             raise Exception(f"{error_type}{description}")
         raise Exception(f"{error_type} on line {line_num}{description}")
 
+    # Makes func callable from programs as name(...); it receives the evaluated arguments
+    def register_builtin(self, name, func, arg_types, variadic=False):
+        key = (name, None if variadic else len(arg_types))
+        self.builtins[key] = Builtin(name, func, arg_types, variadic)
+
+    # Checks the arguments against the builtin's contract, then calls it
+    def call_builtin(self, builtin, args):
+        for index, arg in enumerate(args):
+            accepted = builtin.arg_types[0] if builtin.variadic else builtin.arg_types[index]
+            if accepted is not None and type(arg) not in accepted:
+                self.error(ErrorType.TYPE_ERROR, f"Invalid type for argument {index + 1} of {builtin.name}")
+        return builtin.func(*args)
+
     def output(self, v):
         if self.console_output:
             print(v)
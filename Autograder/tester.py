@@ -2,11 +2,21 @@
 Implements all CS 131-related test logic; is entry-point for testing framework.
 """
 
+import ast
 import asyncio
+import contextlib
+import gc
 import importlib
-from os import environ, listdir, getcwd
+import io
+import math
+from os import environ, listdir, getcwd, stat
+import platform
+import statistics
 import sys
+import tempfile
+import time
 import traceback
+import tracemalloc
 from operator import itemgetter
 
 from harness import (
@@ -14,7 +24,14 @@ from harness import (
     run_all_tests,
     get_score,
     write_gradescope_output,
+    write_bench_output,
+    write_compare_output,
+    load_perf_baseline,
+    write_perf_baseline,
+    check_perf_regressions,
+    format_perf_diff,
 )
+from history import record_test_run, record_bench_run
 
 
 class TestScaffold(AbstractTestScaffold):
@@ -33,6 +50,17 @@ class TestScaffold(AbstractTestScaffold):
 
         inp = self.__extract_test_data(prog_lines, "IN")
         expected = self.__extract_test_data(prog_lines, "OUT")
+        # *OPTIONS* lines are name=value keyword arguments for the Interpreter, e.g. native_builtins=True
+        options = {}
+        for line in self.__extract_test_data(prog_lines, "OPTIONS"):
+            name, _, value = line.partition("=")
+            options[name.strip()] = ast.literal_eval(value.strip())
+
+        # *WARN* lines are the warnings the interpreter must print to stderr, in any order
+        warnings = self.__extract_test_data(prog_lines, "WARN")
+
+        # *VECTORS* lines are further input lists for batch tests, e.g. ["2", "5", "7"]
+        vectors = [list(ast.literal_eval(line)) for line in self.__extract_test_data(prog_lines, "VECTORS")]
 
         program = "\n".join(prog_lines)
 
@@ -40,16 +68,33 @@ class TestScaffold(AbstractTestScaffold):
             "expected": expected,
             "stdin": inp,
             "program": program,
+            "options": options,
+            "warnings": warnings,
+            "vectors": vectors,
         }
 
+    def make_interpreter(self, environment, interpreter_class=None, **options):
+        """A fresh interpreter with the test's input and options."""
+        interpreter_class = interpreter_class or self.interpreter_lib.Interpreter
+        return interpreter_class(
+            False, list(environment["stdin"]), False, **environment["options"], **options
+        )
+
     def run_test_case(self, test_case, environment):
+        if test_case.get("resume"):
+            return self.run_resume_case(environment)
+        if test_case.get("batch"):
+            return self.run_batch_case(environment)
         expect_failure = itemgetter("expect_failure")(test_case)
-        stdin, expected, program = itemgetter("stdin", "expected", "program")(
-            environment
-        )
-        interpreter = self.interpreter_lib.Interpreter(False, stdin, False)
+        expected, program = itemgetter("expected", "program")(environment)
+        stderr = io.StringIO()
+        interpreter = self.make_interpreter(environment)
         try:
-            interpreter.run(program)
+            if environment["warnings"]:
+                with contextlib.redirect_stderr(stderr):
+                    interpreter.run(program)
+            else:
+                interpreter.run(program)
         except Exception as exception:  # pylint: disable=broad-except
             if expect_failure:
 
@@ -83,9 +128,83 @@ class TestScaffold(AbstractTestScaffold):
             print("\nActual output:")
             print(interpreter.get_output())
 
+        if environment["warnings"]:
+            warnings = [
+                line for line in stderr.getvalue().splitlines() if line.startswith("WARNING")
+            ]
+            if sorted(warnings) != sorted(environment["warnings"]):
+                print("\nExpected warnings:")
+                print(environment["warnings"])
+                print("\nActual warnings:")
+                print(warnings)
+                passed = False
+
         return int(passed)
 
 
+    def run_resume_case(self, environment):
+        """
+        Run with a checkpoint after every main statement, then resume from each
+        checkpoint in a fresh interpreter; every run must print the expected output.
+        """
+        expected, program = itemgetter("expected", "program")(environment)
+        with tempfile.TemporaryDirectory() as directory:
+            interpreter = self.make_interpreter(
+                environment,
+                checkpoint_path=f"{directory}/checkpoint{{n}}",
+                checkpoint_every=1,
+            )
+            interpreter.run(program)
+            runs = [("run", interpreter.get_output())]
+            for checkpoint in range(interpreter.checkpoint_count):
+                resumed = self.make_interpreter(environment)
+                resumed.resume(f"{directory}/checkpoint{checkpoint}")
+                runs.append((f"resume from checkpoint {checkpoint}", resumed.get_output()))
+
+        passed = True
+        for label, output in runs:
+            if output != expected:
+                print(f"\nExpected output:\n{expected}\n\nActual output ({label}):\n{output}")
+                passed = False
+        return int(passed and len(runs) > 1)
+
+    def run_batch_case(self, environment):
+        """
+        Run the program on its input and on every *VECTORS* list with fresh interpreters, then with
+        one reused BatchRunner, with a process pool of them and in lockstep (brewvector); every run
+        must match the fresh one, and the run on the test's own input must print the expected output.
+        """
+        brewbatch = importlib.import_module("brewbatch")
+        brewvector = importlib.import_module("brewvector")
+        expected, program = itemgetter("expected", "program")(environment)
+        vectors = [environment["stdin"]] + environment["vectors"]
+        fresh = []
+        for inputs in vectors:
+            interpreter = self.make_interpreter({**environment, "stdin": inputs})
+            try:
+                interpreter.run(program)
+                fresh.append(brewbatch.BatchResult(list(interpreter.get_output())))
+            except Exception as exception:  # pylint: disable=broad-except
+                error_type, _ = interpreter.get_error_type_and_line()
+                fresh.append(brewbatch.BatchResult(list(interpreter.get_output()), error_type, str(exception)))
+
+        runner = brewbatch.BatchRunner(program, self.interpreter_lib.__name__, **environment["options"])
+        runs = [
+            ("reused runner", runner.run_all(vectors)),
+            ("process pool", runner.run_all(vectors, processes=2, chunksize=1)),
+            ("lockstep", brewvector.run_lockstep(program, vectors)),
+        ]
+
+        passed = fresh[0].output == expected
+        if not passed:
+            print(f"\nExpected output:\n{expected}\n\nActual output:\n{fresh[0].output}")
+        for label, results in runs:
+            for inputs, want, got in zip(vectors, fresh, results):
+                if got != want:
+                    print(f"\nInput {inputs}, fresh interpreter:\n{want}\n\n{label}:\n{got}")
+                    passed = False
+        return int(passed)
+
     def __extract_test_data(self, program, tag):
         in_soln = False
         soln = []
@@ -98,6 +217,143 @@ class TestScaffold(AbstractTestScaffold):
         return soln
 
 
+class CompiledTestScaffold(TestScaffold):
+    """
+    Test cases on brewcompile, with its module cache in cache_dir: every case must pass, and plain
+    cases must also print, warn and fail exactly as they do on the interpreter (interpreterv4).
+    """
+
+    def __init__(self, interpreter_lib, reference_lib, cache_dir):
+        super().__init__(interpreter_lib)
+        self.reference_lib = reference_lib
+        self.cache_dir = cache_dir
+
+    def setup(self, test_case):
+        environment = super().setup(test_case)
+        environment["options"]["cache_dir"] = self.cache_dir
+        return environment
+
+    def run_test_case(self, test_case, environment):
+        passed = super().run_test_case(test_case, environment)
+        if test_case.get("resume") or test_case.get("batch"):
+            return passed
+        reference_options = {k: v for k, v in environment["options"].items() if k != "cache_dir"}
+        compiled = self.outcome(environment, self.interpreter_lib.Interpreter, environment["options"])
+        interpreted = self.outcome(environment, self.reference_lib.Interpreter, reference_options)
+        if compiled != interpreted:
+            print(f"\nInterpreted (output, error, stderr):\n{interpreted}\n\nCompiled:\n{compiled}")
+            return 0
+        return passed
+
+    def outcome(self, environment, interpreter_class, options):
+        """Output, error type and message, and stderr of one run."""
+        interpreter = interpreter_class(False, list(environment["stdin"]), False, **options)
+        stderr = io.StringIO()
+        error = (None, None)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+                interpreter.run(environment["program"])
+        except Exception as exception:  # pylint: disable=broad-except
+            error = (interpreter.get_error_type_and_line()[0], str(exception))
+        return list(interpreter.get_output()), *error, stderr.getvalue()
+
+
+class BenchScaffold(TestScaffold):
+    """Benchmark test cases: check the output once, then time repeated runs and count executed statements."""
+
+    def __init__(self, interpreter_lib, warmups=1, repeats=5):
+        super().__init__(interpreter_lib)
+        self.warmups = warmups
+        self.repeats = repeats
+
+    def run_benchmark(self, test_case):
+        """Return a result entry with wall times (seconds) and statements executed per second."""
+        environment = self.setup(test_case)
+        result = {"name": test_case["name"], "srcfile": test_case["srcfile"]}
+        # the correctness check doubles as the first warmup run
+        if not self.run_test_case(test_case, environment):
+            result["status"] = "failed"
+            return result
+        for _ in range(self.warmups - 1):
+            self.time_run(environment)
+
+        times = [self.time_run(environment) for _ in range(self.repeats)]
+        median = statistics.median(times)
+        statements = self.count_statements(environment)
+        peak_memory = self.measure_memory(environment)
+        result.update(
+            {
+                "status": "ok",
+                "warmups": self.warmups,
+                "repeats": self.repeats,
+                "times": times,
+                "median": median,
+                "p95": percentile(times, 0.95),
+                "statements": statements,
+                "ops_per_sec": statements / median if median else None,
+                "peak_memory": peak_memory,
+            }
+        )
+        return result
+
+    def fresh_interpreter(self, environment):
+        """
+        An interpreter that parses the program again, as v1-v3 always do: v4 keeps
+        parsed programs in a process-wide UNIT_CACHE, which would leave parsing
+        out of every measured run after the first.
+        """
+        unit_cache = getattr(self.interpreter_lib, "UNIT_CACHE", None)
+        if unit_cache is not None:
+            unit_cache.clear()
+        return self.make_interpreter(environment)
+
+    def time_run(self, environment):
+        """Run the program once with GC paused (as timeit does); return the wall time in seconds."""
+        interpreter = self.fresh_interpreter(environment)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            interpreter.run(environment["program"])
+            return time.perf_counter() - start
+        finally:
+            gc.enable()
+
+    def count_statements(self, environment):
+        """Run the program once with an instrumented interpreter; return the number of statements executed."""
+        base = self.interpreter_lib.Interpreter
+
+        class CountingInterpreter(base):
+            statements = 0
+            # counted loops step their counter without running the increment statement
+            SPECIALIZE_LOOPS = False
+
+            def run_statement(self, *args):
+                self.statements += 1
+                return super().run_statement(*args)
+
+        interpreter = self.make_interpreter(environment, CountingInterpreter)
+        interpreter.run(environment["program"])
+        return interpreter.statements
+
+
+    def measure_memory(self, environment):
+        """Run the program once under tracemalloc; return the peak traced memory in bytes."""
+        interpreter = self.fresh_interpreter(environment)
+        tracemalloc.start()
+        try:
+            interpreter.run(environment["program"])
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
 def __generate_test_case_structure(
     cases, directory, category="", expect_failure=False, visible=lambda _: True
 ):
@@ -165,16 +421,242 @@ def generate_test_suite_v4():
     """wrapper for generate_test_suite for v4"""
     tests = __get_file_names(getcwd() + "/v4/tests/")
     fails = __get_file_names(getcwd() + "/v4/fails/")
+    # programs in v4/resume must print the same output when resumed from any of their checkpoints
+    resumes = __generate_test_case_structure(
+        __get_file_names(getcwd() + "/v4/resume/"), "v4/resume/", "Resume"
+    )
+    for test in resumes:
+        test["resume"] = True
+    # programs in v4/batch must give the same results run fresh, through one BatchRunner, in a pool
+    # and in lockstep
+    batches = __generate_test_case_structure(
+        __get_file_names(getcwd() + "/v4/batch/"), "v4/batch/", "Batch"
+    )
+    for test in batches:
+        test["batch"] = True
     return __generate_test_suite(
         4,
         tests,
         fails,
+    ) + resumes + batches
+
+def generate_bench_suite():
+    """benchmark programs in bench/; each also carries its expected output"""
+    programs = sorted(__get_file_names(getcwd() + "/bench/"))
+    return __generate_test_case_structure(programs, "bench/", "Benchmark")
+
+
+def check_compile_cache(brewcompile):
+    """
+    A program's compiled module is written to the cache once, reused by later loads, and
+    rewritten when a unit it includes changes; a changed program gets a module of its own.
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = f"{directory}/cache"
+        unit = f"{directory}/unit.br"
+        program = 'include "unit.br";\n\nfunc main() {\n  print(greeting());\n}\n'
+
+        def write_unit(text):
+            with open(unit, "w", encoding="utf-8") as handle:
+                handle.write(f'func greeting() {{\n  return "{text}";\n}}\n')
+
+        def run(source, expected):
+            interpreter = brewcompile.Interpreter(False, [], False, cache_dir=cache_dir, include_dir=directory)
+            interpreter.run(source)
+            if interpreter.get_output() != expected:
+                failures.append(f"expected {expected}, got {interpreter.get_output()}")
+            return {name: (stat(f"{cache_dir}/{name}").st_ino, stat(f"{cache_dir}/{name}").st_mtime_ns)
+                    for name in listdir(cache_dir)}
+
+        write_unit("first")
+        written = run(program, ["first"])
+        if len(written) != 1:
+            failures.append(f"expected one cached module, found {sorted(written)}")
+        if run(program, ["first"]) != written:
+            failures.append("the cached module was rewritten although nothing changed")
+        write_unit("second")
+        rewritten = run(program, ["second"])
+        if rewritten.keys() != written.keys() or rewritten == written:
+            failures.append("the cached module was not rewritten after the included unit changed")
+        changed = run(program.replace("print(greeting());", "print(greeting(), \"!\");"), ["second!"])
+        if len(changed) != 2 or not rewritten.items() <= changed.items():
+            failures.append("a changed program did not get a cached module of its own")
+    return failures
+
+
+async def run_compiled_tests():
+    """run the v4 suite on brewcompile against interpreterv4, with a cold and then a warm module cache"""
+    brewcompile = importlib.import_module("brewcompile")
+    reference = importlib.import_module("interpreterv4")
+    tests = generate_test_suite_v4()
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scaffold = CompiledTestScaffold(brewcompile, reference, cache_dir)
+        for cache in ["cold", "warm"]:
+            print(f"Compiled modules, {cache} cache:")
+            results += await run_all_tests(scaffold, tests, slowest=0)
+
+    failures = check_compile_cache(brewcompile)
+    print("Module cache: " + ("PASSED" if not failures else "FAILED\n  " + "\n  ".join(failures)))
+    results.append({"name": "Compiled | module cache", "score": int(not failures), "max_score": 1})
+    print(f"Total Score: {get_score(results) / len(results) * 100.0:9.2f}%")
+
+
+def run_benchmarks(version):
+    """time every bench/ program on interpreterv{version}; write bench_results.json"""
+    module_name = f"interpreterv{version}"
+    interpreter = importlib.import_module(module_name)
+    scaffold = BenchScaffold(
+        interpreter,
+        int(environ.get("BENCH_WARMUPS", 1)),
+        int(environ.get("BENCH_REPEATS", 5)),
+    )
+
+    benchmarks = generate_bench_suite()
+    print(f"Running {len(benchmarks)} benchmarks...")
+    results = []
+    for benchmark in benchmarks:
+        print(f'Running {benchmark["srcfile"]}... ', end="")
+        result = scaffold.run_benchmark(benchmark)
+        if result["status"] == "ok":
+            print(
+                f' {result["median"] * 1000:.1f} ms median, {result["p95"] * 1000:.1f} ms p95, '
+                f'{result["ops_per_sec"]:.0f} stmts/s, {result["peak_memory"] / 1024:.0f} KiB peak'
+            )
+        else:
+            print(" FAILED")
+        results.append(result)
+
+    record_history(record_bench_run, version, interpreter, results)
+    write_bench_output(
+        {
+            "version": version,
+            "interpreter": module_name,
+            "python": platform.python_version(),
+            "warmups": scaffold.warmups,
+            "repeats": scaffold.repeats,
+            "benchmarks": results,
+        }
     )
 
+
+def format_comparison(versions, programs, runs, key, scale, unit):
+    """table with one row per program and one column per version; - where a version fails the program"""
+    lines = [f"{'program':<20}" + "".join(f"{'v' + version:>12}" for version in versions) + f"  ({unit})"]
+    for program in programs:
+        cells = []
+        for version in versions:
+            result = runs[program][version]
+            cells.append(f"{result[key] / scale:>12.1f}" if result["status"] == "ok" else f"{'-':>12}")
+        lines.append(f"{program:<20}" + "".join(cells))
+    return lines
+
+
+def format_comparison_chart(versions, programs, runs, width=40):
+    """bars of median time per version, scaled to the slowest version of each program, with the change
+    from the previous version that ran the program"""
+    lines = []
+    for program in programs:
+        timed = [(version, runs[program][version]["median"]) for version in versions
+                 if runs[program][version]["status"] == "ok"]
+        if not timed:
+            continue
+        slowest = max(median for _, median in timed)
+        lines.append(program)
+        previous = None
+        for version, median in timed:
+            bar = "#" * max(1, round(width * median / slowest))
+            change = f"  x{median / previous:.2f} vs previous" if previous else ""
+            lines.append(f"  v{version:<3}{bar:<{width}} {median * 1000:8.1f} ms{change}")
+            previous = median
+    return lines
+
+
+def compare_versions(versions):
+    """run the bench/ programs on every version; report time and peak memory side by side"""
+    warmups = int(environ.get("BENCH_WARMUPS", 1))
+    repeats = int(environ.get("BENCH_REPEATS", 5))
+    benchmarks = generate_bench_suite()
+    programs = [benchmark["srcfile"].split("/")[-1].split(".")[0] for benchmark in benchmarks]
+    runs = {program: {} for program in programs}
+    for version in versions:
+        scaffold = BenchScaffold(importlib.import_module(f"interpreterv{version}"), warmups, repeats)
+        print(f"Running {len(benchmarks)} benchmarks on v{version}...")
+        for program, benchmark in zip(programs, benchmarks):
+            # programs a version cannot run are expected here; keep their diagnostics out of the report
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                runs[program][version] = scaffold.run_benchmark(benchmark)
+
+    report = ["", "Median wall time"]
+    report += format_comparison(versions, programs, runs, "median", 0.001, "ms")
+    report += ["", "Peak traced memory"]
+    report += format_comparison(versions, programs, runs, "peak_memory", 1024, "KiB")
+    report += ["", "Median wall time by version"]
+    report += format_comparison_chart(versions, programs, runs)
+    print("\n".join(report))
+
+    write_compare_output(
+        {
+            "versions": versions,
+            "python": platform.python_version(),
+            "warmups": warmups,
+            "repeats": repeats,
+            "benchmarks": runs,
+        }
+    )
+
+
+def record_history(record, version, interpreter, *results):
+    """append the run to the local results database (RESULTS_DB, results.db by default; empty to skip)"""
+    path = environ.get("RESULTS_DB", "results.db")
+    if path and not environ.get("PROD", False):
+        record(path, version, interpreter, *results)
+
+
+def check_perf_baseline(results, version):
+    """
+    Gate on stored timing baselines (PERF_BASELINE, perf_baseline.json by default):
+    with PERF_UPDATE set, store this run's timings as the version's baseline;
+    otherwise turn tests slower than their baseline into performance failures.
+    """
+    path = environ.get("PERF_BASELINE", "perf_baseline.json")
+    if environ.get("PERF_UPDATE"):
+        write_perf_baseline(results, version, path)
+        print(f"Stored timing baselines for v{version} in {path}.")
+        return
+    baseline = load_perf_baseline(path).get(version)
+    if not baseline:
+        return
+    rows = check_perf_regressions(
+        results,
+        baseline,
+        tolerance=float(environ.get("PERF_TOLERANCE", 0.25)),
+        noise=float(environ.get("PERF_NOISE", 3)),
+        floor=float(environ.get("PERF_FLOOR_MS", 1)) / 1000,
+    )
+    regressions = [row for row in rows if row[2] > row[3]]
+    print(f"\nTimings against the baselines in {path}:")
+    print("\n".join(format_perf_diff(rows)))
+    print(f"{len(regressions)}/{len(rows)} tests slower than their baseline.")
+
+
 async def main():
     """main entrypoint: argparses, delegates to test scaffold, suite generator, gradescope output"""
     if not sys.argv:
         raise ValueError("Error: Missing version number argument")
+    if sys.argv[1] == "bench":
+        if len(sys.argv) < 3:
+            raise ValueError("Error: Missing version number argument")
+        run_benchmarks(sys.argv[2])
+        return
+    if sys.argv[1] == "compare":
+        compare_versions(sys.argv[2:] or ["1", "2", "3", "4"])
+        return
+    if sys.argv[1] == "compile":
+        await run_compiled_tests()
+        return
+
     version = sys.argv[1]
     module_name = f"interpreterv{version}"
     interpreter = importlib.import_module(module_name)
@@ -193,7 +675,14 @@ async def main():
         case _:
             raise ValueError("Unsupported version; expect one of {1, 2, 3, 4}")
 
-    results = await run_all_tests(scaffold, tests)
+    results = await run_all_tests(
+        scaffold,
+        tests,
+        repeats=int(environ.get("TEST_REPEATS", 1)),
+        slowest=int(environ.get("TEST_SLOWEST", 10)),
+        check_results=lambda results: check_perf_baseline(results, version),
+    )
+    record_history(record_test_run, version, interpreter, tests, results)
     total_score = get_score(results) / len(results) * 100.0
     print(f"Total Score: {total_score:9.2f}%")
 
@@ -0,0 +1,306 @@
+from element import Element
+from intbase import InterpreterBase
+
+# Static analyses over the Brewin# AST produced by brewparse
+
+BUILTIN_FUNCS = ("print", "inputi", "inputs")
+
+
+# Yields every Element in the subtree rooted at node (including node itself)
+def walk(node):
+    stack = [node]
+    while stack:
+        curr = stack.pop()
+        yield curr
+        for value in curr.dict.values():
+            if isinstance(value, Element):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(v for v in value if isinstance(v, Element))
+
+
+def base_name(name):
+    return name.split(".")[0]
+
+
+# Returns (names, called_funcs, dynamic_call) for the subtree rooted at node: names are
+# all variable names it reads, writes, declares or calls through, and dynamic_call is set by
+# method calls, whose target is only known at runtime
+def referenced_names(node):
+    names = set()
+    calls = set()
+    dynamic_call = False
+    for elem in walk(node):
+        if elem.elem_type in [InterpreterBase.VAR_DEF, "=", InterpreterBase.ARG_DEF, InterpreterBase.REFARG_DEF]:
+            names.add(base_name(elem.get("name")))
+        elif elem.elem_type == InterpreterBase.FCALL_DEF:
+            names.add(elem.get("name"))
+            if elem.get("name") not in BUILTIN_FUNCS:
+                calls.add(elem.get("name"))
+        elif elem.elem_type == InterpreterBase.MCALL_DEF:
+            names.add(elem.get("objref"))
+            dynamic_call = True
+    return names, calls, dynamic_call
+
+
+# Names assigned or bound as parameters anywhere in the program; a call through one of these
+# may reach a closure rather than the top-level function of the same name
+def variable_names(program):
+    return {base_name(elem.get("name")) for elem in walk(program)
+            if elem.elem_type in ["=", InterpreterBase.ARG_DEF, InterpreterBase.REFARG_DEF]}
+
+
+# Maps each lambda node to the frozenset of names it must capture when created, or None if it has
+# to capture everything. Called functions run on top of the lambda's captured scopes, so the names
+# they reference count as well; calls whose target is only known at runtime (closures, methods)
+# make the analysis give up for that lambda.
+def lambda_free_variables(program):
+    func_nodes = {}
+    for func in program.get("functions"):
+        func_nodes.setdefault(func.get("name"), []).append(func)
+    variables = variable_names(program)
+
+    func_refs = {}
+    for name, funcs in func_nodes.items():
+        names, calls, dynamic_call = set(), set(), False
+        for func in funcs:
+            f_names, f_calls, f_dynamic = referenced_names(func)
+            names |= f_names
+            calls |= f_calls
+            dynamic_call = dynamic_call or f_dynamic
+        func_refs[name] = (names, calls, dynamic_call)
+
+    free_vars = {}
+    for node in walk(program):
+        if node.elem_type != InterpreterBase.LAMBDA_DEF:
+            continue
+        names, calls, dynamic_call = referenced_names(node)
+        pending = list(calls)
+        seen = set()
+        while pending and not dynamic_call:
+            call = pending.pop()
+            if call in seen:
+                continue
+            seen.add(call)
+            if call not in func_refs or call in variables:
+                dynamic_call = True
+                break
+            f_names, f_calls, f_dynamic = func_refs[call]
+            names |= f_names
+            pending.extend(f_calls)
+            dynamic_call = f_dynamic
+        free_vars[node] = None if dynamic_call else frozenset(names)
+    return free_vars
+
+
+# A function is a memoization candidate on its own if it does no I/O, takes no ref parameters and
+# never touches objects, lambdas, methods or 'this'
+def is_locally_pure(func):
+    for elem in walk(func):
+        if elem.elem_type in [InterpreterBase.REFARG_DEF, InterpreterBase.MCALL_DEF,
+                              InterpreterBase.LAMBDA_DEF, InterpreterBase.OBJ_DEF]:
+            return False
+        if elem.elem_type in [InterpreterBase.VAR_DEF, "="]:
+            name = elem.get("name")
+            if "." in name or name == InterpreterBase.THIS_DEF:
+                return False
+        if elem.elem_type == InterpreterBase.FCALL_DEF and elem.get("name") in BUILTIN_FUNCS:
+            return False
+    return True
+
+
+# Maps (name, arg count) of every pure top-level function to its guard names: the names it and the
+# functions it calls touch, other than its own parameters. Called functions run on top of the
+# caller's scopes, so a call only depends on nothing but its arguments (and can be skipped without
+# losing side effects) when none of the guard names is bound in any scope at call time.
+def pure_functions(program):
+    func_nodes = {}
+    for func in program.get("functions"):
+        func_nodes.setdefault(func.get("name"), []).append(func)
+    variables = variable_names(program)
+
+    func_refs = {}
+    pure = set()
+    for name, funcs in func_nodes.items():
+        names, calls = set(), set()
+        for func in funcs:
+            f_names, f_calls, _ = referenced_names(func)
+            names |= f_names
+            calls |= f_calls
+        func_refs[name] = (names, calls)
+        if all(is_locally_pure(func) for func in funcs) and \
+                all(call in func_nodes and call not in variables for call in calls):
+            pure.add(name)
+
+    # Drop functions that call impure ones until nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not func_refs[name][1] <= pure:
+                pure.remove(name)
+                changed = True
+
+    guards = {}
+    for name in pure:
+        names = set()
+        pending = [name]
+        seen = set()
+        while pending:
+            curr = pending.pop()
+            if curr in seen:
+                continue
+            seen.add(curr)
+            names |= func_refs[curr][0]
+            pending.extend(func_refs[curr][1])
+        for func in func_nodes[name]:
+            params = {arg.get("name") for arg in func.get("args")}
+            guards[(name, len(func.get("args")))] = frozenset(names - params)
+    return guards
+
+
+# Maps every function and lambda node that can be called in isolation (e.g. in another process) to its
+# guard names, as pure_functions does for top-level functions. A lambda qualifies when its body is
+# locally pure and only calls pure top-level functions; its guard also covers the names it would read
+# from the scopes it captured.
+def isolated_callables(program):
+    guards = pure_functions(program)
+    variables = variable_names(program)
+    isolated = {func: guards[(func.get("name"), len(func.get("args")))] for func in program.get("functions")
+                if (func.get("name"), len(func.get("args"))) in guards}
+    pure_names = {name for name, _ in guards}
+    for node in walk(program):
+        if node.elem_type != InterpreterBase.LAMBDA_DEF:
+            continue
+        if not all(is_locally_pure(stat) for stat in node.get("statements")):
+            continue
+        names, calls, dynamic_call = referenced_names(node)
+        if dynamic_call or not all(call in pure_names and call not in variables for call in calls):
+            continue
+        for (name, _), guard in guards.items():
+            if name in calls:
+                names |= guard
+        params = {arg.get("name") for arg in node.get("args")}
+        isolated[node] = frozenset(names - params)
+    return isolated
+
+
+# Maps every top-level function name to the names it, or any function it calls, assigns other than the
+# assigning function's own parameters. Under dynamic scoping such an assignment changes the caller's
+# variable of that name whenever one is bound.
+def function_writes(program):
+    func_nodes = {}
+    for func in program.get("functions"):
+        func_nodes.setdefault(func.get("name"), []).append(func)
+
+    own_writes = {}
+    func_calls = {}
+    for name, funcs in func_nodes.items():
+        writes = set()
+        for func in funcs:
+            params = {arg.get("name") for arg in func.get("args")}
+            writes |= {base_name(elem.get("name")) for elem in walk(func)
+                       if elem.elem_type == "="} - params
+        own_writes[name] = writes
+        func_calls[name] = set().union(*(referenced_names(func)[1] for func in funcs))
+
+    writes = {}
+    for name in func_nodes:
+        names = set()
+        pending = [name]
+        seen = set()
+        while pending:
+            curr = pending.pop()
+            if curr in seen or curr not in func_nodes:
+                continue
+            seen.add(curr)
+            names |= own_writes[curr]
+            pending.extend(func_calls[curr])
+        writes[name] = frozenset(names)
+    return writes
+
+
+# Names the side effect of evaluating an expression, or returns None if it has none: builtin I/O,
+# method calls, calls to anything but a pure top-level function (see pure_functions) and calls to
+# pure functions that assign names other than their parameters (see function_writes) all count
+def side_effect(node, pure, variables, writes):
+    for elem in walk(node):
+        if elem.elem_type == InterpreterBase.MCALL_DEF:
+            return f"method call {elem.get('objref')}.{elem.get('name')}()"
+        if elem.elem_type == InterpreterBase.FCALL_DEF:
+            name = elem.get("name")
+            if name in variables or (name, len(elem.get("args"))) not in pure:
+                return f"call to {name}()"
+            if writes.get(name):
+                return f"call to {name}() assigning {', '.join(sorted(writes[name]))}"
+    return None
+
+
+# Lists (function name, operator, side effect) for every && and || whose right operand has a side
+# effect, i.e. one that short-circuit evaluation would skip
+def short_circuit_hazards(program):
+    pure = pure_functions(program)
+    variables = variable_names(program)
+    writes = function_writes(program)
+    hazards = []
+    for func in program.get("functions"):
+        for elem in walk(func):
+            if elem.elem_type not in ["&&", "||"]:
+                continue
+            effect = side_effect(elem.get("op2"), pure, variables, writes)
+            if effect is not None:
+                hazards.append((func.get("name"), elem.elem_type, effect))
+    return hazards
+
+
+COUNTED_LOOP_OPS = ["<", "<=", ">", ">=", "!="]
+
+
+# Returns the undotted variable name an expression reads, or None if it is anything else
+def plain_variable(node):
+    if node is None or node.elem_type != InterpreterBase.VAR_DEF:
+        return None
+    name = node.get("name")
+    if "." in name or name == InterpreterBase.THIS_DEF:
+        return None
+    return name
+
+
+# Maps every counted while loop to (counter, op, bound_name, bound_value, step_op, step): loops whose
+# condition compares a plain variable against an int literal or another plain variable, whose last
+# statement is counter = counter +/- int literal, and whose other statements never assign either
+# name. Callees can still assign them through dynamic scoping, so the executor re-reads both on
+# every iteration; the analysis only guarantees that the increment is the loop's own.
+def counted_loops(program):
+    loops = {}
+    for node in walk(program):
+        if node.elem_type != InterpreterBase.WHILE_DEF or not node.get("statements"):
+            continue
+        condition = node.get("condition")
+        if condition is None or condition.elem_type not in COUNTED_LOOP_OPS:
+            continue
+        counter = plain_variable(condition.get("op1"))
+        bound = condition.get("op2")
+        bound_name = plain_variable(bound)
+        if counter is None or counter == bound_name:
+            continue
+        if bound_name is None and (bound is None or bound.elem_type != InterpreterBase.INT_DEF):
+            continue
+
+        increment = node.get("statements")[-1]
+        step = increment.get("expression") if increment.elem_type == "=" else None
+        if (increment.elem_type != "=" or increment.get("name") != counter or step is None or
+                step.elem_type not in ["+", "-"] or plain_variable(step.get("op1")) != counter or
+                step.get("op2") is None or step.get("op2").elem_type != InterpreterBase.INT_DEF):
+            continue
+
+        assigned = set()
+        for stat in node.get("statements")[:-1]:
+            assigned |= {base_name(elem.get("name")) for elem in walk(stat) if elem.elem_type == "="}
+        if counter in assigned or bound_name in assigned:
+            continue
+
+        loops[node] = (counter, condition.elem_type, bound_name,
+                       None if bound_name is not None else bound.get("val"),
+                       step.elem_type, step.get("op2").get("val"))
+    return loops
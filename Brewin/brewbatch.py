@@ -0,0 +1,73 @@
+import importlib
+import multiprocessing
+
+# Runs one Brewin program against many input vectors. The program is parsed and its function
+# tables, analyses (and, with brewcompile, generated code) are prepared once; each vector then only
+# resets the runtime state and runs main. With a process pool, every worker prepares the program
+# once and runs its share of the vectors.
+
+
+# Outcome of one run: the printed lines, and the error type and message if the run failed
+class BatchResult:
+    __slots__ = ("output", "error_type", "error")
+
+    def __init__(self, output, error_type=None, error=None):
+        self.output = output
+        self.error_type = error_type
+        self.error = error
+
+    def __repr__(self):
+        return f"BatchResult({self.output!r}, {self.error_type!r}, {self.error!r})"
+
+    def __eq__(self, other):
+        if type(other) is not BatchResult:
+            return NotImplemented
+        return (self.output, self.error_type, self.error) == (other.output, other.error_type, other.error)
+
+
+class BatchRunner:
+    # module is the name of the interpreter module (e.g. interpreterv4 or brewcompile), so that pool
+    # workers can import it; options are passed on to its Interpreter. A program that does not parse
+    # raises SyntaxError here, once, rather than failing every run.
+    def __init__(self, program, module="interpreterv4", **options):
+        self.program = program
+        self.module = module
+        self.options = options
+        self.interpreter = importlib.import_module(module).Interpreter(False, [], False, **options)
+        self.parsed_program = self.interpreter.load_program(program)
+
+    # Runs the program against one input vector; same result as a fresh Interpreter(False, inputs)
+    def run(self, inputs):
+        interpreter = self.interpreter
+        interpreter.inp = list(inputs)
+        interpreter.reset()
+        try:
+            interpreter.run_loaded(self.parsed_program)
+        except Exception as exception:  # pylint: disable=broad-except
+            error_type, _ = interpreter.get_error_type_and_line()
+            return BatchResult(list(interpreter.get_output()), error_type, str(exception))
+        return BatchResult(list(interpreter.get_output()))
+
+    # Runs the program against every input vector, in order. With processes > 1 the vectors are
+    # spread over a pool of that many workers, chunksize vectors at a time.
+    def run_all(self, input_vectors, processes=None, chunksize=64):
+        if not processes or processes <= 1:
+            return [self.run(inputs) for inputs in input_vectors]
+        with multiprocessing.Pool(processes, init_worker, (self.program, self.module, self.options)) as pool:
+            return pool.map(run_worker, [list(inputs) for inputs in input_vectors], chunksize)
+
+
+worker_runner = None
+
+
+def init_worker(program, module, options):
+    global worker_runner
+    worker_runner = BatchRunner(program, module, **options)
+
+
+def run_worker(inputs):
+    return worker_runner.run(inputs)
+
+
+def run_batch(program, input_vectors, module="interpreterv4", processes=None, **options):
+    return BatchRunner(program, module, **options).run_all(input_vectors, processes)
@@ -0,0 +1,39 @@
+import functools
+import math
+
+from intbase import ErrorType
+
+# Native math and string builtins for interpreterv4, registered when native_builtins=True
+
+
+def to_string(value):
+    return str(value).lower() if type(value) in [bool] else str(value)
+
+
+def mod(interpreter, a, b):
+    if b == 0:
+        interpreter.error(ErrorType.FAULT_ERROR, "Modulo by zero")
+    return a % b
+
+
+NATIVE_BUILTINS = [
+    # math
+    ("abs", abs, [int]),
+    ("min", min, [int, int]),
+    ("max", max, [int, int]),
+    ("gcd", math.gcd, [int, int]),
+    # strings
+    ("strlen", len, [str]),
+    ("substr", lambda s, start, end: s[start:end], [str, int, int]),
+    ("find", lambda s, sub: s.find(sub), [str, str]),
+    ("repeat", lambda s, n: s * n, [str, int]),
+    ("upper", str.upper, [str]),
+    ("lower", str.lower, [str]),
+    ("tostring", to_string, [(int, bool, str)]),
+]
+
+
+def register_natives(interpreter):
+    for name, func, arg_types in NATIVE_BUILTINS:
+        interpreter.register_builtin(name, func, arg_types)
+    interpreter.register_builtin("mod", functools.partial(mod, interpreter), [int, int])
@@ -0,0 +1,317 @@
+from element import Element
+from intbase import InterpreterBase
+from brewparse import parse_program
+from brewanalyze import counted_loops
+import interpreterv4
+import contextlib
+import hashlib
+import importlib.util
+import io
+import marshal
+import os
+
+# Ahead-of-time compiler from a parsed Brewin# program to a Python module.
+#
+# Every function and lambda body becomes a Python function: statements turn into straight-line
+# Python (if/while become native if/while, return becomes a native return), and expressions become
+# nested calls to interpreterv4's value-level helpers (binary_operation, read_variable, assign_value, ...).
+# Calls, scoping, closures, ref parameters and objects still go through the same interpreterv4
+# runtime methods, so compiled programs behave exactly like interpreted ones. The generated module
+# also rebuilds the AST, so a cached module can be run without parsing the source again; messages the
+# parser printed while recovering from syntax errors are replayed from the module as well.
+#
+# A program that includes other units is compiled linked; the module records the sha256 of every
+# included unit, and is recompiled when any of them has changed since.
+
+COMPILER_VERSION = "4"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__brewcache__")
+
+
+class ProgramCompiler:
+    def __init__(self, program, parse_output="", short_circuit=False, units=None, include_root=None):
+        self.program = program
+        self.parse_output = parse_output
+        self.short_circuit = short_circuit
+        self.units = units or {}
+        self.include_root = include_root
+        self.temp_count = 0
+        self.counted_loops = counted_loops(program)
+        self.node_index = {}
+        self.node_lines = []
+        self.chunks = []
+        self.bodies = []
+        self.exprs = []
+
+    # Numbers nodes children-first and emits the code that rebuilds each of them
+    def index_nodes(self, node):
+        if id(node) in self.node_index:
+            return self.node_index[id(node)]
+        fields = []
+        for key, value in node.dict.items():
+            fields.append(f"{key}={self.field_source(value)}")
+        index = len(self.node_lines)
+        self.node_index[id(node)] = index
+        self.node_lines.append(f"    N[{index}] = Element({node.elem_type!r}{''.join(', ' + f for f in fields)})")
+        return index
+
+    def field_source(self, value):
+        if isinstance(value, Element):
+            return f"N[{self.index_nodes(value)}]"
+        if isinstance(value, list):
+            return "[" + ", ".join(self.field_source(v) for v in value) + "]"
+        return repr(value)
+
+    def node_ref(self, node):
+        return f"N[{self.node_index[id(node)]}]"
+
+    # Python source for an expression node; lsi is only threaded into a top-level variable read,
+    # which is where the interpreter uses it (evaluating call arguments)
+    def expression(self, node, lsi="-1"):
+        if node is None or node.elem_type == InterpreterBase.NIL_DEF:
+            return "None"
+        elif node.elem_type in [InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF, InterpreterBase.BOOL_DEF]:
+            return repr(node.get("val"))
+        elif node.elem_type == InterpreterBase.VAR_DEF:
+            return f"rt.read_variable({node.get('name').split('.')!r}, {lsi})"
+        elif node.elem_type == InterpreterBase.OBJ_DEF:
+            return "[None, {}]"
+        elif node.elem_type == InterpreterBase.LAMBDA_DEF:
+            return f"rt.make_closure({self.node_ref(node)})"
+        elif node.elem_type == InterpreterBase.FCALL_DEF:
+            self.call_args(node)
+            return f"rt.do_func_call({self.node_ref(node)})"
+        elif node.elem_type == InterpreterBase.MCALL_DEF:
+            self.call_args(node)
+            return f"rt.do_member_call({self.node_ref(node)})"
+        elif self.short_circuit and node.elem_type in interpreterv4.SHORT_CIRCUIT_RESULTS:
+            # Python's conditional expression skips the right operand; the left one is kept in a
+            # temporary for the full operation
+            op = node.elem_type
+            result = interpreterv4.SHORT_CIRCUIT_RESULTS[op]
+            temp = f"t{self.temp_count}"
+            self.temp_count += 1
+            test = f"rt.logical_operand({op!r}, ({temp} := {self.expression(node.get('op1'))}))"
+            return (f"({result} if {'' if result else 'not '}{test} else "
+                    f"rt.binary_operation({op!r}, {temp}, {self.expression(node.get('op2'))}))")
+        elif node.elem_type in interpreterv4.BINARY_OPERATORS:
+            return f"rt.binary_operation({node.elem_type!r}, {self.expression(node.get('op1'))}, {self.expression(node.get('op2'))})"
+        elif node.elem_type in interpreterv4.UNARY_OPERATORS:
+            return f"rt.unary_operation({node.elem_type!r}, {self.expression(node.get('op1'))})"
+        return "None"
+
+    # Call arguments are evaluated by the runtime (run_func, print, inputi), so each one gets its
+    # own function that the runtime's evaluate_expression dispatches to
+    def call_args(self, node):
+        for arg in node.get("args") or []:
+            index = self.node_index[id(arg)]
+            self.add_chunk(f"def expr_{index}(rt, lsi):\n    return {self.expression(arg, 'lsi')}\n",
+                           self.exprs, index)
+
+    def statements(self, statements, indent, depth):
+        lines = []
+        for stat in statements or []:
+            lines.extend(self.statement(stat, indent, depth))
+        return lines or [indent + "pass"]
+
+    def statement(self, stat, indent, depth):
+        if stat.elem_type == "=":
+            names = stat.get("name").split(".")
+            source = stat.get("expression")
+            if len(names) >= 2 and names[1] == "proto":
+                if source is not None and source.elem_type == InterpreterBase.VAR_DEF:
+                    value = f"rt.read_variable({source.get('name').split('.')!r}, -1, True)"
+                else:
+                    value = self.expression(source)
+                return [f"{indent}rt.assign_proto({names!r}, {value})"]
+            return [f"{indent}rt.assign_value({names!r}, {self.expression(source)}, lsi)"]
+        elif stat.elem_type in [InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF]:
+            return [indent + self.expression(stat)]
+        elif stat.elem_type == InterpreterBase.IF_DEF:
+            lines = [f"{indent}stack.append({{}})",
+                     f"{indent}if rt.to_condition({self.expression(stat.get('condition'))}, 'for'):"]
+            lines += self.statements(stat.get("statements"), indent + "    ", depth + 1)
+            if stat.get("else_statements"):
+                lines.append(f"{indent}else:")
+                lines += self.statements(stat.get("else_statements"), indent + "    ", depth + 1)
+            lines.append(f"{indent}stack.pop()")
+            return lines
+        elif stat.elem_type == InterpreterBase.WHILE_DEF and stat in self.counted_loops:
+            # Same shape as interpreterv4.run_counted_loop, keeping the general condition and increment
+            # for when the runtime cannot bind the loop
+            loop = f"loop{self.node_index[id(stat)]}"
+            increment = stat.get("statements")[-1]
+            lines = [f"{indent}stack.append({{}})",
+                     f"{indent}{loop} = rt.enter_counted_loop({self.node_ref(stat)})",
+                     f"{indent}while (rt.counted_loop_test({loop}) if {loop} is not None else "
+                     f"rt.to_condition({self.expression(stat.get('condition'))}, 'while')):"]
+            lines += self.statements(stat.get("statements")[:-1], indent + "    ", depth + 1)
+            lines += [f"{indent}    if {loop} is not None:",
+                      f"{indent}        rt.counted_loop_step({loop}, lsi)",
+                      f"{indent}    else:"]
+            lines += self.statement(increment, indent + "        ", depth + 1)
+            lines.append(f"{indent}stack.pop()")
+            return lines
+        elif stat.elem_type == InterpreterBase.WHILE_DEF:
+            lines = [f"{indent}stack.append({{}})",
+                     f"{indent}while rt.to_condition({self.expression(stat.get('condition'))}, 'while'):"]
+            lines += self.statements(stat.get("statements"), indent + "    ", depth + 1)
+            lines.append(f"{indent}stack.pop()")
+            return lines
+        elif stat.elem_type == InterpreterBase.RETURN_DEF:
+            lines = [f"{indent}ret = rt.copy_value({self.expression(stat.get('expression'))})"]
+            if depth > 0:
+                lines.append(f"{indent}del stack[base:]")
+            lines.append(f"{indent}return ret")
+            return lines
+        # Other expression statements are not evaluated by the interpreter either
+        return []
+
+    def body(self, func):
+        index = self.node_index[id(func)]
+        lines = [f"def body_{index}(rt, lsi):",
+                 "    stack = rt.variable_name_to_value",
+                 "    base = len(stack)"]
+        lines += self.statements(func.get("statements"), "    ", 0)
+        lines.append("    return None")
+        self.add_chunk("\n".join(lines) + "\n", self.bodies, index)
+
+    # Keeps a generated function only if CPython can compile it (e.g. it rejects more than 20
+    # nested loops); anything left out simply runs through the interpreter
+    def add_chunk(self, source, table, index):
+        try:
+            compile(source, "<brewin>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            return
+        self.chunks.append(source)
+        table.append(index)
+
+    def generate(self):
+        self.index_nodes(self.program)
+        stack = [self.program]
+        while stack:
+            node = stack.pop()
+            if node.elem_type in [InterpreterBase.FUNC_DEF, InterpreterBase.LAMBDA_DEF]:
+                self.body(node)
+            for value in node.dict.values():
+                if isinstance(value, Element):
+                    stack.append(value)
+                elif isinstance(value, list):
+                    stack.extend(v for v in value if isinstance(v, Element))
+
+        source = [f"# Generated by brewcompile {COMPILER_VERSION}",
+                  f"PARSE_OUTPUT = {self.parse_output!r}",
+                  f"UNITS = {self.units!r}",
+                  f"INCLUDE_ROOT = {self.include_root!r}",
+                  "def build_nodes(Element):",
+                  f"    N = [None] * {len(self.node_lines)}"]
+        source += self.node_lines
+        source.append("    return N\n")
+        source += self.chunks
+        source.append("BODIES = {" + ", ".join(f"{i}: body_{i}" for i in self.bodies) + "}")
+        source.append("EXPRS = {" + ", ".join(f"{i}: expr_{i}" for i in self.exprs) + "}")
+        return "\n".join(source) + "\n"
+
+
+# interpreter resolves and links included units (see interpreterv4's link_units); by default, relative
+# to the working directory
+def compile_program(program, short_circuit=False, interpreter=None):
+    linker = interpreter or interpreterv4.Interpreter(False, [])
+    parse_output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(parse_output):
+            parsed_program = linker.link_units(parse_program(program))
+    except Exception:
+        print(parse_output.getvalue(), end="")
+        raise
+    units = dict(linker.unit_hashes)
+    include_root = linker.include_root() if units else None
+    return ProgramCompiler(parsed_program, parse_output.getvalue(), short_circuit, units, include_root).generate()
+
+
+# Returns the code object for the program's generated module, from cache_dir when an entry for the
+# same source (and evaluation mode) exists, unless refresh is set. Entries are hash-based .pyc files named
+# after the source's sha256.
+def load_code(program, cache_dir=DEFAULT_CACHE_DIR, short_circuit=False, interpreter=None, refresh=False):
+    mode = "short-circuit" if short_circuit else ""
+    source_bytes = (COMPILER_VERSION + "\0" + mode + "\0" + program).encode("utf-8")
+    key = hashlib.sha256(source_bytes).hexdigest()
+    source_hash = importlib.util.source_hash(source_bytes)
+    header = importlib.util.MAGIC_NUMBER + (1).to_bytes(4, "little") + source_hash
+    path = os.path.join(cache_dir, f"{key}.pyc") if cache_dir else None
+
+    if path is not None and not refresh:
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+            if data[:len(header)] == header:
+                return marshal.loads(data[len(header):])
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+
+    code = compile(compile_program(program, short_circuit, interpreter), f"<brewin {key[:12]}>", "exec")
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as handle:
+                handle.write(header + marshal.dumps(code))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+    return code
+
+
+class Interpreter(interpreterv4.Interpreter):
+    def __init__(self, console_output=True, inp=None, trace_output=False, cache_dir=DEFAULT_CACHE_DIR, **options):
+        super().__init__(console_output, inp, trace_output, **options)
+        self.cache_dir = cache_dir
+        self.compiled_bodies = {}
+        self.compiled_exprs = {}
+
+    def load_program(self, program):
+        namespace = {}
+        exec(load_code(program, self.cache_dir, self.short_circuit, self), namespace)
+        if not self.units_current(namespace["UNITS"], namespace["INCLUDE_ROOT"]):
+            namespace = {}
+            exec(load_code(program, self.cache_dir, self.short_circuit, self, refresh=True), namespace)
+        self.unit_hashes = namespace["UNITS"]
+        if namespace["PARSE_OUTPUT"]:
+            print(namespace["PARSE_OUTPUT"], end="")
+        nodes = namespace["build_nodes"](Element)
+        namespace["N"] = nodes
+        self.compiled_bodies = {nodes[index]: func for index, func in namespace["BODIES"].items()}
+        self.compiled_exprs = {nodes[index]: func for index, func in namespace["EXPRS"].items()}
+
+        parsed_program = nodes[-1]
+        if (self.trace_output):
+            print(parsed_program)
+        self.load_functions(parsed_program)
+        return parsed_program
+
+    # Whether the included units a module was compiled with are still those the program would include
+    def units_current(self, units, include_root):
+        if not units:
+            return True
+        if include_root != self.include_root():
+            return False
+        for path, digest in units.items():
+            try:
+                with open(path, encoding="utf-8") as handle:
+                    source = handle.read()
+            except OSError:
+                return False
+            if hashlib.sha256(source.encode("utf-8")).hexdigest() != digest:
+                return False
+        return True
+
+    def evaluate_expression(self, node, lambda_scope_index = -1, use_proto = False):
+        compiled = self.compiled_exprs.get(node)
+        if compiled is None or use_proto:
+            return super().evaluate_expression(node, lambda_scope_index, use_proto)
+        return compiled(self, lambda_scope_index)
+
+    def run_body(self, func, lambda_scope_index):
+        compiled = self.compiled_bodies.get(func)
+        if compiled is None:
+            return super().run_body(func, lambda_scope_index)
+        return compiled(self, lambda_scope_index)
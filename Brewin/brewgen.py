@@ -0,0 +1,306 @@
+"""
+Seeded generator of large, valid Brewin# programs with known output.
+
+Programs are built from top-level functions (with loops, conditionals and calls to earlier
+functions) and, in main, one group of objects with methods and proto chains, a lambda capturing a
+variable and a ref call per function, so every construct grows with the program. Every loop has a
+literal bound and calls only go to earlier functions (plus one recursive helper with a literal
+argument), so programs always terminate. The generator evaluates what it emits as it goes, so the
+expected output comes from the generator, not from an interpreter.
+
+usage: python3 brewgen.py [--seed SEED] [--functions N | --bytes SIZE] [-o FILE]
+"""
+
+import argparse
+import random
+import sys
+
+# Call chains through generated functions are at most this deep, so running a program costs
+# time linear in its size
+MAX_CALL_DEPTH = 6
+COMPARISONS = {"<": int.__lt__, "<=": int.__le__, ">": int.__gt__, ">=": int.__ge__, "==": int.__eq__,
+               "!=": int.__ne__}
+
+HELPERS = """func sumdown(n) {
+  if (n <= 0) {
+    return 0;
+  }
+  return n + sumdown(n - 1);
+}
+
+func bump(ref r, d) {
+  r = r + d;
+}
+
+"""
+
+
+# Objects as the generator models them: fields (with methods as ("get", offset)) and a proto
+class ModelObject:
+    def __init__(self, proto=None):
+        self.fields = {}
+        self.proto = proto
+
+    def lookup(self, name):
+        obj = self
+        while name not in obj.fields:
+            obj = obj.proto
+        return obj.fields[name]
+
+
+# Emits a program piece by piece. Expressions come with an evaluator, so function bodies can be
+# evaluated for any arguments and main's output is known as soon as it is generated.
+class ProgramGenerator:
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.functions = []     # (name, params, depth, func) for every generated function
+        self.depths = {}
+        self.callees = []       # the functions that may still be called without exceeding MAX_CALL_DEPTH
+        self.chunks = [HELPERS]
+        self.output = []
+        self.size = len(HELPERS)
+        self.main_groups = []
+
+    def literal(self, low=0, high=9):
+        value = self.random.randint(low, high)
+        return str(value), value
+
+    # Adds a function; its body is kept as source lines plus a list of steps that apply the statements'
+    # effects to an environment, so that it can be evaluated for any arguments
+    def add_function(self, statements=6):
+        index = len(self.functions)
+        name = f"f{index}"
+        params = [f"p{k}" for k in range(self.random.randint(1, 3))]
+        local_names = [f"{name}_v{k}" for k in range(self.random.randint(1, 3))]
+        counter = f"{name}_i"
+        plan = self.function_plan(params, local_names, counter, statements)
+        depth = 1 + max([self.depths[callee] for callee in plan["callees"]] or [0])
+
+        def func(*args):
+            env = dict(zip(params, args))
+            for step in plan["steps"]:
+                step(env)
+            return plan["result"](env)
+
+        lines = [f"func {name}({', '.join(params)}) {{"] + plan["lines"] + ["}", ""]
+        self.emit(lines)
+        self.functions.append((name, params, depth, func))
+        self.depths[name] = depth
+        if depth < MAX_CALL_DEPTH:
+            self.callees.append((name, params, func))
+        return name
+
+    # Locals (named after the function, so that dynamic scoping never lets a callee assign a caller's
+    # variable) are all set at the top, then come assignments, if/else and counted loops
+    def function_plan(self, params, local_names, counter, statements):
+        plan = {"lines": [], "steps": [], "callees": set()}
+        variables = list(params)
+
+        def add(line, step):
+            plan["lines"].append(line)
+            plan["steps"].append(step)
+
+        for local in local_names + [counter]:
+            source, value = self.literal()
+            add(f"  {local} = {source};", lambda env, local=local, value=value: env.__setitem__(local, value))
+            variables.append(local)
+
+        for _ in range(statements):
+            kind = self.random.random()
+            target = self.random.choice(local_names)
+            if kind < 0.5:
+                source, evaluate = self.expression(variables, plan, allow_calls=True)
+                add(f"  {target} = {source};",
+                    lambda env, target=target, evaluate=evaluate: env.__setitem__(target, evaluate(env)))
+            elif kind < 0.75:
+                cond_source, cond = self.condition(variables)
+                then_source, then_eval = self.expression(variables, plan)
+                else_source, else_eval = self.expression(variables, plan)
+                plan["lines"] += [f"  if ({cond_source}) {{", f"    {target} = {then_source};", "  } else {",
+                                  f"    {target} = {else_source};", "  }"]
+                plan["steps"].append(lambda env, target=target, cond=cond, then_eval=then_eval, else_eval=else_eval:
+                                     env.__setitem__(target, then_eval(env) if cond(env) else else_eval(env)))
+            else:
+                bound = self.random.randint(1, 6)
+                step_source, step_eval = self.expression([v for v in variables if v != target], plan,
+                                                         additive=True)
+                plan["lines"] += [f"  {counter} = 0;", f"  while ({counter} < {bound}) {{",
+                                  f"    {target} = {target} + {step_source};",
+                                  f"    {counter} = {counter} + 1;", "  }"]
+
+                def loop(env, target=target, bound=bound, step_eval=step_eval):
+                    for count in range(bound):
+                        env[counter] = count
+                        env[target] = env[target] + step_eval(env)
+                    env[counter] = bound
+                plan["steps"].append(loop)
+
+        result = self.random.choice(local_names)
+        result_source, evaluate = self.expression(variables, plan)
+        plan["lines"].append(f"  return {result} + {result_source};")
+        plan["result"] = lambda env: env[result] + evaluate(env)
+        return plan
+
+    # Integer expression over the given variable names, as (source, evaluator over an environment that
+    # maps names to values). Calls go to earlier functions only when allow_calls; additive expressions
+    # only use + and -, as loops add them up
+    def expression(self, variables, plan, depth=2, allow_calls=False, additive=False):
+        choice = self.random.random()
+        if depth == 0 or choice < 0.3:
+            if variables and self.random.random() < 0.6:
+                name = self.random.choice(variables)
+                return name, lambda env, name=name: env[name]
+            source, value = self.literal()
+            return source, lambda env, value=value: value
+        if allow_calls and choice < 0.45:
+            if self.callees:
+                name, params, func = self.random.choice(self.callees)
+                plan["callees"].add(name)
+                args = [self.expression(variables, plan, 1) for _ in params]
+                return (f"{name}({', '.join(source for source, _ in args)})",
+                        lambda env, func=func, args=args: func(*[evaluate(env) for _, evaluate in args]))
+        if not additive and choice < 0.55:
+            source, evaluate = self.expression(variables, plan, depth - 1)
+            divisor = self.random.randint(2, 5)
+            return f"{source} / {divisor}", lambda env: evaluate(env) // divisor
+        if not additive and choice < 0.65:
+            source, evaluate = self.expression(variables, plan, depth - 1)
+            factor = self.random.randint(2, 3)
+            return f"{source} * {factor}", lambda env: evaluate(env) * factor
+        op = self.random.choice(["+", "-"])
+        left_source, left = self.expression(variables, plan, depth - 1, allow_calls, additive)
+        right_source, right = self.expression(variables, plan, depth - 1, allow_calls, additive)
+        if op == "+":
+            return f"({left_source} + {right_source})", lambda env: left(env) + right(env)
+        return f"({left_source} - {right_source})", lambda env: left(env) - right(env)
+
+    def condition(self, variables):
+        op = self.random.choice(sorted(COMPARISONS))
+        left_source, left = self.expression(variables, {"callees": set()}, 1)
+        right_source, right = self.expression(variables, {"callees": set()}, 1)
+        compare = COMPARISONS[op]
+        if self.random.random() < 0.2:
+            return f"!({left_source} {op} {right_source})", lambda env: not compare(left(env), right(env))
+        return f"{left_source} {op} {right_source}", lambda env: compare(left(env), right(env))
+
+    def emit(self, lines):
+        text = "\n".join(lines) + "\n"
+        self.chunks.append(text)
+        self.size += len(text)
+
+    # main is built alongside the functions: globals first, then one group of objects (with a method and
+    # a proto chain), a lambda capturing a global and a ref call per generated function, and finally one
+    # call to every generated function, printing as it goes
+    def start_main(self):
+        self.variables = {}
+        self.main = []
+        for k in range(3):
+            source, value = self.literal(1, 20)
+            self.emit_main([f"  g{k} = {source};"])
+            self.variables[f"g{k}"] = value
+
+    def emit_main(self, lines):
+        self.main += lines
+        self.size += sum(len(line) + 1 for line in lines)
+
+    def value_of(self, depth=1):
+        source, evaluate = self.expression(sorted(self.variables), {"callees": set()}, depth)
+        return source, evaluate(self.variables)
+
+    def show(self, lines, label, source, value):
+        lines.append(f'  print("{label} ", {source});')
+        self.output.append(f"{label} {value}")
+
+    def add_main_group(self):
+        group = len(self.main_groups)
+        self.main_groups.append(group)
+        lines = []
+        objects = []
+        for k in range(self.random.randint(1, 3)):
+            obj = ModelObject(objects[-1][1] if objects else None)
+            name = f"o{group}_{k}"
+            lines.append(f"  {name} = @;")
+            if objects:
+                lines.append(f"  {name}.proto = {objects[-1][0]};")
+            if not objects or self.random.random() < 0.5:
+                source, value = self.value_of()
+                lines.append(f"  {name}.x = {source};")
+                obj.fields["x"] = value
+            if not objects:
+                offset = self.random.randint(0, 9)
+                lines.append(f"  {name}.get = lambda() {{ return this.x + {offset}; }};")
+                obj.fields["get"] = ("get", offset)
+            objects.append((name, obj))
+        for name, obj in objects:
+            _, offset = obj.lookup("get")
+            self.show(lines, f"{name}.get", f"{name}.get()", obj.lookup("x") + offset)
+
+        # the lambda is called before any later ref call can change the global it captured
+        name = f"l{group}"
+        scale = self.random.randint(1, 3)
+        captured = self.random.choice(sorted(self.variables))
+        lines.append(f"  {name} = lambda(x) {{ return x * {scale} + {captured}; }};")
+        source, value = self.value_of()
+        self.show(lines, name, f"{name}({source})", value * scale + self.variables[captured])
+
+        target = self.random.choice(sorted(self.variables))
+        source, value = self.value_of()
+        lines.append(f"  bump({target}, {source});")
+        self.variables[target] += value
+        self.show(lines, target, target, self.variables[target])
+        self.emit_main(lines)
+
+    def main_lines(self):
+        lines = ["func main() {"] + self.main
+        depth = self.random.randint(1, 30)
+        self.show(lines, "sumdown", f"sumdown({depth})", depth * (depth + 1) // 2)
+
+        for name, params, _, func in self.functions:
+            args = [self.value_of() for _ in params]
+            self.show(lines, name, f"{name}({', '.join(source for source, _ in args)})",
+                      func(*[value for _, value in args]))
+        lines += ["}", ""]
+        return lines
+
+    def generate(self, functions=None, size=None, statements=6):
+        """Return (source, expected output lines) for a program with the given number of functions, or
+        with enough functions for the source to reach size bytes."""
+        self.start_main()
+        count = 0
+        while (functions is not None and count < functions) or (size is not None and self.size < size):
+            self.add_function(statements)
+            self.add_main_group()
+            count += 1
+        if not self.main_groups:
+            self.add_main_group()
+        main = self.main_lines()
+        return "".join(self.chunks) + "\n".join(main), self.output
+
+
+def generate_program(seed=0, functions=None, size=None, statements=6):
+    if functions is None and size is None:
+        functions = 10
+    return ProgramGenerator(seed).generate(functions, size, statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a random Brewin# program with its expected output")
+    parser.add_argument("--seed", type=int, default=0)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--functions", type=int, help="number of generated functions (default 10)")
+    group.add_argument("--bytes", type=int, help="generate functions until the source is at least this large")
+    parser.add_argument("--statements", type=int, default=6, help="statements per generated function")
+    parser.add_argument("-o", "--output", help="file to write (default: standard output)")
+    args = parser.parse_args()
+
+    source, expected = generate_program(args.seed, args.functions, args.bytes, args.statements)
+    # the expected output goes in the *OUT* block the autograder reads
+    text = source + "\n/*\n*OUT*\n" + "".join(line + "\n" for line in expected) + "*OUT*\n*/\n"
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    else:
+        sys.stdout.write(text)
+
+if __name__ == "__main__":
+    main()
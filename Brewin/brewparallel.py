@@ -0,0 +1,39 @@
+import importlib
+import multiprocessing
+
+from element import Element
+from intbase import InterpreterBase
+
+# Worker side of interpreterv4's pmap builtin. Each worker process gets the pure functions of the
+# program (see brewanalyze.isolated_callables) and the function value to apply once, when the pool
+# starts, and then only receives integer arguments. Calls run in a fresh interpreter with no scopes
+# of their own, which is why only callables isolated from the caller's scopes are sent here.
+
+worker_interpreter = None
+worker_target = None
+
+
+def init_worker(module, functions, target, options):
+    global worker_interpreter, worker_target
+    worker_interpreter = importlib.import_module(module).Interpreter(False, [], **options)
+    worker_interpreter.load_functions(Element(InterpreterBase.PROGRAM_DEF, functions=functions))
+    worker_target = target
+
+
+# Returns (True, value), or (False, (error_type, exception)) if the call failed
+def run_worker(arg):
+    try:
+        return True, worker_interpreter.call_value(worker_target, [arg])
+    except Exception as exception:  # pylint: disable=broad-except
+        error_type, _ = worker_interpreter.get_error_type_and_line()
+        worker_interpreter.reset()
+        return False, (error_type, exception)
+
+
+# Applies target to every argument on a pool of processes workers; results are in argument order.
+# options are passed to the workers' Interpreter constructor
+def parallel_map(functions, target, args, processes, module="interpreterv4", options=None):
+    processes = min(processes, len(args))
+    chunksize = max(1, len(args) // (processes * 4))
+    with multiprocessing.Pool(processes, init_worker, (module, functions, target, options or {})) as pool:
+        return pool.map(run_worker, args, chunksize)
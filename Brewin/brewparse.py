@@ -24,8 +24,23 @@ def collapse_items(p, group_index, singleton_index):
 
 
 def p_program(p):
-    "program : funcs"
-    p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[1])
+    """program : includes funcs
+    | funcs"""
+    if len(p) == 3:  # handle units that include others
+        p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[2], includes=p[1])
+    else:
+        p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[1])
+
+
+def p_includes(p):
+    """includes : includes include
+    | include"""
+    collapse_items(p, 1, 2)  # 2 -> include
+
+
+def p_include(p):
+    "include : INCLUDE STRING SEMI"
+    p[0] = Element(InterpreterBase.INCLUDE_DEF, path=p[2])
 
 
 def p_funcs(p):
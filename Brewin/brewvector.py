@@ -0,0 +1,319 @@
+from intbase import InterpreterBase, ErrorType
+from brewanalyze import walk
+from brewbatch import BatchResult, BatchRunner
+from interpreterv4 import (BINARY_OPERATIONS, BINARY_OPERATORS, NUMERIC_TYPES, OPERATION_ERRORS, UNARY_OPERATIONS,
+                           UNARY_OPERATORS)
+
+try:
+    import numpy as np
+except ImportError:  # optional: without NumPy every run goes through the per-row interpreter
+    np = None
+
+# Lockstep execution of one program over many input vectors. For programs whose main does integer and
+# bool arithmetic, printing and inputi only, every variable is held as one NumPy vector over all input
+# rows (or a plain value when it is the same in every row) and main runs once. When a branch or loop
+# condition differs between rows, the rows are split by the way they go and each group is run again in
+# lockstep; rows that would leave the supported subset (e.g. an int overflowing 64 bits, a division by
+# zero or a missing input) are run per row by interpreterv4, and the other rows again in lockstep.
+# Results are always exactly those of per-row interpreterv4 runs.
+
+BUILTIN_CALLS = ["print", "inputi"]
+
+# Largest operand magnitudes for which NumPy's int64 results match Python's unbounded ints
+ADD_LIMIT = 2 ** 62
+MUL_LIMIT = 2 ** 31
+
+# Element-wise versions of the binary operators, for operands already checked and coerced
+if np is not None:
+    ARITHMETIC = {
+        "+": np.add, "-": np.subtract, "*": np.multiply,
+        "&&": np.logical_and, "||": np.logical_or,
+        "==": np.equal, "!=": np.not_equal,
+        "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+    }
+
+
+class Divergence(Exception):
+    """Rows leave the supported subset; rows is a boolean mask of them, or None for every row."""
+
+    def __init__(self, rows=None):
+        super().__init__()
+        self.rows = rows
+
+
+class BranchDivergence(Divergence):
+    """Rows need different paths through the program; rows is a boolean mask of those taking the branch."""
+
+
+class LockstepError(Exception):
+    """A Brewin error raised identically in every row."""
+
+    def __init__(self, error_type, description):
+        super().__init__(f"{error_type}: {description}")
+        self.error_type = error_type
+
+
+class MainReturned(Exception):
+    pass
+
+
+# Statements and expressions main may contain; anything else (other calls, objects, lambdas, refs,
+# dotted names) runs per row
+def lockstep_supported(main):
+    if main.get("args"):
+        return False
+    for elem in walk(main):
+        if elem.elem_type in [InterpreterBase.MCALL_DEF, InterpreterBase.LAMBDA_DEF, InterpreterBase.OBJ_DEF,
+                              InterpreterBase.REFARG_DEF]:
+            return False
+        if elem.elem_type == InterpreterBase.FCALL_DEF and elem.get("name") not in BUILTIN_CALLS:
+            return False
+        if elem.elem_type in [InterpreterBase.VAR_DEF, "="]:
+            name = elem.get("name")
+            if "." in name or name == InterpreterBase.THIS_DEF:
+                return False
+    return True
+
+
+def is_vector(data):
+    return type(data) is np.ndarray
+
+
+def magnitude(data):
+    return int(np.abs(data).max()) if is_vector(data) else abs(data)
+
+
+def as_ints(data):
+    return data.astype(np.int64) if is_vector(data) else int(data)
+
+
+# Rows where a value is at least limit in magnitude (None when all rows share it)
+def beyond(data, limit):
+    return np.abs(data) >= limit if is_vector(data) else None
+
+
+def truth(data):
+    return data != 0 if is_vector(data) else bool(data)
+
+
+def print_text(kind, data):
+    if not is_vector(data):
+        return str(data).lower() if kind is bool else str(data)
+    if kind is bool:
+        return np.where(data, "true", "false")
+    return data.astype(str)
+
+
+# Values are (type, data) pairs: the Brewin type every row shares (int, bool, str or NoneType) and
+# either a plain Python value, when all rows agree, or a NumPy vector with one entry per row
+class LockstepExecutor:
+    def __init__(self, parsed_program, input_vectors):
+        self.parsed_program = parsed_program
+        self.input_vectors = input_vectors
+        self.rows = len(input_vectors)
+        self.function_names = {func.get("name") for func in parsed_program.get("functions")}
+        self.scopes = []
+        self.input_cursor = 0
+        # one entry per output line: a value shared by all rows, or a list with one value per row
+        self.output_columns = []
+
+    def run(self):
+        main = [func for func in self.parsed_program.get("functions") if func.get("name") == "main"]
+        if not main or not lockstep_supported(main[0]):
+            raise Divergence()
+        self.scopes.append({})
+        try:
+            self.run_block(main[0].get("statements"))
+        except MainReturned:
+            pass
+        except LockstepError as exception:
+            return [BatchResult(output, exception.error_type, str(exception)) for output in self.row_outputs()]
+        return [BatchResult(output) for output in self.row_outputs()]
+
+    def row_outputs(self):
+        outputs = [[] for _ in range(self.rows)]
+        for column in self.output_columns:
+            if type(column) is list:
+                for output, value in zip(outputs, column):
+                    output.append(value)
+            else:
+                for output in outputs:
+                    output.append(column)
+        return outputs
+
+    def error(self, error_type, description):
+        raise LockstepError(error_type, description)
+
+    def run_block(self, statements):
+        for stat in statements or []:
+            if stat.elem_type == "=":
+                self.assign(stat.get("name"), self.evaluate(stat.get("expression")))
+            elif stat.elem_type == InterpreterBase.FCALL_DEF:
+                self.call(stat)
+            elif stat.elem_type == InterpreterBase.IF_DEF:
+                self.scopes.append({})
+                to_execute = "statements" if self.condition(stat, "for") else "else_statements"
+                self.run_block(stat.get(to_execute))
+                self.scopes.pop()
+            elif stat.elem_type == InterpreterBase.WHILE_DEF:
+                self.scopes.append({})
+                while self.condition(stat, "while"):
+                    self.run_block(stat.get("statements"))
+                self.scopes.pop()
+            elif stat.elem_type == InterpreterBase.RETURN_DEF:
+                self.evaluate(stat.get("expression"))
+                raise MainReturned()
+
+    def assign(self, name, value):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                scope[name] = value
+                return
+        self.scopes[-1][name] = value
+
+    def condition(self, stat, construct):
+        kind, data = self.evaluate(stat.get("condition"))
+        if kind not in NUMERIC_TYPES:
+            self.error(ErrorType.TYPE_ERROR, f"Expected boolean/integer input in {construct}, got {data}")
+        if not is_vector(data):
+            return bool(data)
+        taken = data != 0
+        if taken.all():
+            return True
+        if not taken.any():
+            return False
+        raise BranchDivergence(taken)
+
+    def evaluate(self, node):
+        if node is None or node.elem_type == InterpreterBase.NIL_DEF:
+            return type(None), None
+        elif node.elem_type in [InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF, InterpreterBase.BOOL_DEF]:
+            return type(node.get("val")), node.get("val")
+        elif node.elem_type == InterpreterBase.VAR_DEF:
+            name = node.get("name")
+            for scope in reversed(self.scopes):
+                if name in scope:
+                    return scope[name]
+            if name in self.function_names:
+                raise Divergence()
+            self.error(ErrorType.NAME_ERROR, f"Variable/Function {name} has not been defined")
+        elif node.elem_type == InterpreterBase.FCALL_DEF:
+            return self.call(node)
+        elif node.elem_type in UNARY_OPERATORS:
+            return self.unary(node.elem_type, self.evaluate(node.get("op1")))
+        elif node.elem_type in BINARY_OPERATORS:
+            left = self.evaluate(node.get("op1"))
+            right = self.evaluate(node.get("op2"))
+            return self.binary(node.elem_type, left, right)
+        return type(None), None
+
+    def call(self, node):
+        params = node.get("args") or []
+        if node.get("name") == "print":
+            text = ""
+            for param in params:
+                part = print_text(*self.evaluate(param))
+                text = np.char.add(text, part) if is_vector(text) or is_vector(part) else text + part
+            self.output_columns.append(text.tolist() if is_vector(text) else text)
+            return type(None), None
+
+        if len(params) > 1:
+            self.error(ErrorType.NAME_ERROR, f"No input() function found that takes > 1 parameter")
+        elif len(params) == 1:
+            _, prompt = self.evaluate(params[0])
+            self.output_columns.append(prompt.tolist() if is_vector(prompt) else prompt)
+        values = []
+        unreadable = []
+        for inputs in self.input_vectors:
+            # an empty input list makes the interpreter read the keyboard
+            try:
+                value = int(inputs[self.input_cursor]) if inputs else None
+            except (IndexError, TypeError, ValueError):
+                value = None
+            unreadable.append(value is None or not -2 ** 63 <= value < 2 ** 63)
+            values.append(0 if unreadable[-1] else value)
+        if any(unreadable):
+            raise Divergence(np.array(unreadable))
+        self.input_cursor += 1
+        return int, np.array(values, dtype=np.int64)
+
+    def unary(self, op, value):
+        kind, data = value
+        if (op, kind) not in UNARY_OPERATIONS:
+            self.error(ErrorType.TYPE_ERROR, OPERATION_ERRORS[op])
+        if not is_vector(data):
+            result = UNARY_OPERATIONS[(op, kind)](data)
+            return type(result), result
+        if op == InterpreterBase.NEG_DEF:
+            if magnitude(data) >= ADD_LIMIT:
+                raise Divergence(beyond(data, ADD_LIMIT))
+            return int, -data
+        return bool, data == 0
+
+    def binary(self, op, left, right):
+        (left_kind, left_data), (right_kind, right_data) = left, right
+        handler = BINARY_OPERATIONS.get((op, left_kind, right_kind))
+        if handler is None:
+            self.error(ErrorType.TYPE_ERROR, OPERATION_ERRORS.get(op, f"Incompatible operator {op} for types"))
+        if not is_vector(left_data) and not is_vector(right_data):
+            try:
+                result = handler(left_data, right_data)
+            except ZeroDivisionError:
+                raise Divergence()
+            return type(result), result
+
+        limit = MUL_LIMIT if op == "*" else ADD_LIMIT
+        for kind, data in [left, right]:
+            if kind in NUMERIC_TYPES and magnitude(data) >= limit:
+                raise Divergence(beyond(data, limit))
+        if op in ["+", "-", "*"]:
+            return int, ARITHMETIC[op](as_ints(left_data), as_ints(right_data))
+        elif op == "/":
+            if (not truth(right_data).all()) if is_vector(right_data) else not right_data:
+                raise Divergence(right_data == 0 if is_vector(right_data) else None)
+            return int, np.floor_divide(as_ints(left_data), as_ints(right_data))
+        elif op in ["&&", "||"]:
+            return bool, ARITHMETIC[op](truth(left_data), truth(right_data))
+        elif op in ["==", "!="]:
+            if left_kind in NUMERIC_TYPES and right_kind in NUMERIC_TYPES:
+                if left_kind is not right_kind:
+                    left_data, right_data = truth(left_data), truth(right_data)
+                return bool, ARITHMETIC[op](left_data, right_data)
+            # rows hold ints or bools, so a value of any other type never equals them
+            return bool, op == "!="
+        return bool, ARITHMETIC[op](left_data, right_data)
+
+
+# Runs the program against every input vector; same results as run_batch, computed in lockstep for
+# every group of rows that takes the same path. processes is only used by the per-row fallback.
+def run_lockstep(program, input_vectors, processes=None):
+    input_vectors = [list(inputs) for inputs in input_vectors]
+    runner = BatchRunner(program)
+    if np is None or not input_vectors:
+        return runner.run_all(input_vectors, processes)
+
+    results = [None] * len(input_vectors)
+    per_row = []
+    groups = [list(range(len(input_vectors)))]
+    while groups:
+        rows = groups.pop()
+        try:
+            group_results = LockstepExecutor(runner.parsed_program, [input_vectors[row] for row in rows]).run()
+        except Divergence as divergence:
+            marks = divergence.rows if divergence.rows is not None else [True] * len(rows)
+            marked = [row for row, mark in zip(rows, marks) if mark]
+            others = [row for row, mark in zip(rows, marks) if not mark]
+            if type(divergence) is BranchDivergence:
+                groups.extend([marked, others])
+            else:
+                per_row.extend(marked)
+                if others:
+                    groups.append(others)
+            continue
+        for row, result in zip(rows, group_results):
+            results[row] = result
+
+    per_row.sort()
+    for row, result in zip(per_row, runner.run_all([input_vectors[row] for row in per_row], processes)):
+        results[row] = result
+    return results
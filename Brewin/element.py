@@ -5,6 +5,10 @@ class Element:
         for key, value in kwargs.items():
             self.dict[key] = value
 
+    # AST nodes are never mutated once parsed, so copies of runtime values can share them
+    def __deepcopy__(self, memo):
+        return self
+
     def get(self, key):
         if key not in self.dict:
             return None
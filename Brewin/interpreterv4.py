@@ -1,36 +1,275 @@
 from intbase import InterpreterBase, ErrorType
 from brewparse import parse_program
+from brewanalyze import (BUILTIN_FUNCS, counted_loops, isolated_callables, lambda_free_variables, pure_functions,
+                         short_circuit_hazards, variable_names)
+from brewbuiltins import register_natives
+from brewparallel import parallel_map
+from collections import OrderedDict
+from element import Element
+import contextlib
 import copy
+import gzip
+import hashlib
+import io
+import operator
+import os
+import pickle
+import sys
+
+# Completion record for a return statement; normal statements complete with None,
+# so statement loops only need an identity check to know when to unwind
+class ReturnSignal:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+# Lambda value: the lambda node plus the environment (list of scopes) it captured. Calls run
+# against the captured scopes in place, so every variable or member holding the closure sees updates
+class Closure:
+    __slots__ = ("func", "scopes")
+
+    def __init__(self, func, scopes):
+        self.func = func
+        self.scopes = scopes
+
+    # Two closures are equal when they come from the same lambda and captured equal values. Only the names
+    # a lambda references are captured (see make_closure), so variables it never reads do not count
+    def __eq__(self, other):
+        if type(other) is not Closure:
+            return NotImplemented
+        return self.func is other.func and self.scopes == other.scopes
+
+# Bounded LRU cache for results of pure function calls, keyed by function and argument values
+class MemoCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+
+    # Returns (found, value)
+    def lookup(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+        self.misses += 1
+        return False, None
+
+    def store(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bypasses": self.bypasses,
+            "size": len(self.entries),
+        }
+
+# Parsed units (programs and the files they include), keyed by the sha256 of their source and shared by
+# all interpreters in the process, so an unchanged unit is parsed only once. Only the max_size most
+# recently used units are kept; clear() drops them all. Messages the parser printed while recovering
+# from syntax errors are replayed on every use, as a fresh parse would print them.
+class UnitCache:
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.units = OrderedDict()
+        self.parses = 0
+
+    def get(self, source):
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        if key in self.units:
+            self.units.move_to_end(key)
+        else:
+            parse_output = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(parse_output):
+                    unit = parse_program(source)
+            except SyntaxError:
+                print(parse_output.getvalue(), end="")
+                raise
+            self.units[key] = (unit, parse_output.getvalue())
+            self.parses += 1
+            if len(self.units) > self.max_size:
+                self.units.popitem(last=False)
+        unit, output = self.units[key]
+        print(output, end="")
+        return unit
+
+    def clear(self):
+        self.units.clear()
+
+UNIT_CACHE = UnitCache()
+
+# One execution of a while loop recognized by brewanalyze.counted_loops, bound to the scopes that
+# hold its counter and bound (bound_scope is None for a literal bound)
+class CountedLoop:
+    __slots__ = ("counter", "op", "bound_name", "bound", "step_op", "step", "counter_scope", "bound_scope")
+
+    def __init__(self, spec, counter_scope, bound_scope):
+        self.counter, self.op, self.bound_name, self.bound, self.step_op, self.step = spec
+        self.counter_scope = counter_scope
+        self.bound_scope = bound_scope
+
+# Operator semantics, resolved by table lookup instead of branching on the operator and operand
+# types. Binary entries are keyed by (operator, type(left), type(right)) and encode Brewin's
+# coercion rules for that pair of operand types; a missing entry is a type error.
+VALUE_TYPES = (int, bool, str, type(None), list, tuple, Closure)
+NUMERIC_TYPES = (int, bool)
+
+def build_binary_operations():
+    table = {}
+    for left in NUMERIC_TYPES:
+        for right in NUMERIC_TYPES:
+            table[("+", left, right)] = operator.add
+            table[("-", left, right)] = operator.sub
+            table[("*", left, right)] = operator.mul
+            table[("/", left, right)] = operator.floordiv
+            table[("||", left, right)] = lambda l, r: bool(l) or bool(r)
+            table[("&&", left, right)] = lambda l, r: bool(l) and bool(r)
+    table[("+", str, str)] = operator.add
+
+    for op, func in [("<", operator.lt), ("<=", operator.le), (">", operator.gt), (">=", operator.ge)]:
+        table[(op, int, int)] = func
+
+    # Any two values can be tested for equality; ints are coerced when compared to bools,
+    # and objects compare by identity
+    for left in VALUE_TYPES:
+        for right in VALUE_TYPES:
+            table[("==", left, right)] = operator.eq
+            table[("!=", left, right)] = operator.ne
+    table[("==", int, bool)] = lambda l, r: (l != 0) == r
+    table[("!=", int, bool)] = lambda l, r: (l != 0) != r
+    table[("==", bool, int)] = lambda l, r: l == (r != 0)
+    table[("!=", bool, int)] = lambda l, r: l != (r != 0)
+    table[("==", list, list)] = operator.is_
+    table[("!=", list, list)] = operator.is_not
+    return table
+
+BINARY_OPERATIONS = build_binary_operations()
+BINARY_OPERATORS = frozenset(op for op, _, _ in BINARY_OPERATIONS)
+
+UNARY_OPERATIONS = {
+    (InterpreterBase.NEG_DEF, int): operator.neg,
+    (InterpreterBase.NOT_DEF, int): operator.not_,
+    (InterpreterBase.NOT_DEF, bool): operator.not_,
+}
+UNARY_OPERATORS = frozenset(op for op, _ in UNARY_OPERATIONS)
+
+OPERATION_ERRORS = {
+    "+": "Incompatible types for arithmetic operation",
+    "-": "Incompatible types for arithmetic operation",
+    "*": "Incompatible types for arithmetic operation",
+    "/": "Incompatible types for arithmetic operation",
+    "||": "Incompatible types for logical operation",
+    "&&": "Incompatible types for logical operation",
+    InterpreterBase.NEG_DEF: "Expected integer type for negation operator",
+    InterpreterBase.NOT_DEF: "Expected bool/int type for not operator",
+}
+
+# With short-circuit evaluation, the result of && and || once the left operand alone decides it
+SHORT_CIRCUIT_RESULTS = {"&&": False, "||": True}
+
+LITERAL_TYPES = frozenset([InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF, InterpreterBase.BOOL_DEF])
 
 class Interpreter(InterpreterBase):
+    PRIMITIVE_TYPES = (int, bool, str, type(None))
+
+    CHECKPOINT_VERSION = 1
+
+    # Run counted while loops with native integer operations (see enter_counted_loop)
+    SPECIALIZE_LOOPS = True
+
+    # Shortest range pmap hands to worker processes; shorter ones are not worth starting a pool for
+    PARALLEL_MAP_MIN = 64
 
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    def __init__(self, console_output=True, inp=None, trace_output=False, checkpoint_path=None, checkpoint_every=1000,
+                 memo_size=0, short_circuit=False, include_dir=None, parallel_processes=None, native_builtins=False):
         super().__init__(console_output, inp)   # call InterpreterBase's constructor
         self.variable_name_to_value = []
         self.function_name_to_node = {}
+        self.lambda_captures = {}
         self.ref_mapping = []
-        self.return_flg = []
         self.trace_output = trace_output
         self.this = None
 
+        # Checkpointing: when a path is given, main runs through the resumable executor and the
+        # state is saved every checkpoint_every main-level statements ({n} in the path keeps one file each)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_count = 0
+        self.statements_since_checkpoint = 0
+        self.parsed_program = None
+        self.main_path = []
+
+        # Memoization of pure functions (see brewanalyze.pure_functions); opt in with memo_size > 0
+        self.memo_cache = MemoCache(memo_size) if memo_size > 0 else None
+        self.pure_functions = {}
+
+        # Short-circuit && and || (skipping the right operand when the left one decides the result);
+        # the operators evaluate both operands by default
+        self.short_circuit = short_circuit
+
+        self.counted_loops = {}
+
+        # include paths of the program itself are relative to include_dir (the working directory by
+        # default); unit_hashes maps the path of every unit linked into the program to its sha256
+        self.include_dir = include_dir
+        self.unit_hashes = {}
+
+        # Worker processes for pmap (all CPUs by default, 1 to always run sequentially); the isolated
+        # callables of the loaded program are only analyzed once pmap is first called
+        self.parallel_processes = parallel_processes
+        self.loaded_program = None
+        self.isolated_callables = None
+
+        self.register_builtin("print", self.print_values, [None], variadic=True)
+        for arg_types in [[], [None]]:
+            self.register_builtin("inputi", self.input_int, arg_types)
+            self.register_builtin("inputs", self.input_string, arg_types)
+        # The native math and string library (see brewbuiltins) and pmap are opt-in; without them, calls
+        # to those names fail like calls to any other undefined function
+        self.native_builtins = native_builtins
+        if native_builtins:
+            register_natives(self)
+            self.register_builtin("pmap", self.parallel_map, [(tuple, Closure), int, int, (tuple, Closure)])
+        self.program_builtins = self.builtins
+
+    # Function values are (func_node,) tuples and lambdas are Closures; returns None for anything else
+    def get_callable_node(self, val):
+        if type(val) in [Closure]:
+            return val.func
+        if type(val) in [tuple]:
+            return val[0]
+        return None
+
+    def check_callable(self, val, var_name, args):
+        func_node = self.get_callable_node(val)
+        if func_node is None:
+            super().error(ErrorType.TYPE_ERROR, f"Invalid call to undefined function {var_name}")
+        elif len(func_node.get('args')) != args:
+            super().error(ErrorType.TYPE_ERROR, f"Invalid number of args to function {var_name}")
+
     def get_variable_value(self, var_name, args = None, lambda_scope_index = -1):
         if (lambda_scope_index > 0):
             for scope in reversed(self.variable_name_to_value[:lambda_scope_index]):
                 if var_name in scope:
                     if (args is not None):
-                        if type(scope[var_name]) not in [tuple]:
-                            super().error(ErrorType.TYPE_ERROR, f"Invalid call to undefined function {var_name}")
-                        elif len(scope[var_name][0].get('args')) != args:
-                            super().error(ErrorType.TYPE_ERROR, f"Invalid number of args to function {var_name}")
+                        self.check_callable(scope[var_name], var_name, args)
                     return scope[var_name]
 
         for scope in reversed(self.variable_name_to_value):
             if var_name in scope:
                 if (args is not None):
-                    if type(scope[var_name]) not in [tuple]:
-                        super().error(ErrorType.TYPE_ERROR, f"Invalid call to undefined function {var_name}")
-                    elif len(scope[var_name][0].get('args')) != args:
-                        super().error(ErrorType.TYPE_ERROR, f"Invalid number of args to function {var_name}")
+                    self.check_callable(scope[var_name], var_name, args)
                 return scope[var_name]
             
         return self.get_function_value(var_name, args)
@@ -52,176 +291,143 @@ class Interpreter(InterpreterBase):
         for scope in (self.variable_name_to_value):
             print(scope)
         print("--------------------END:Variables--------------------")
-        print("--------------------START:ReturnStack--------------------")
-        print(self.return_flg)
-        print("--------------------END:ReturnStack--------------------")
         print("--------------------START:Functions--------------------")
         print(self.function_name_to_node)
         print("--------------------END:Functions--------------------\n")
 
-    def do_arithmetic(self, node):
+    def do_binary_operation(self, node):
+        if self.short_circuit and node.elem_type in SHORT_CIRCUIT_RESULTS:
+            return self.do_short_circuit_operation(node)
         left = self.evaluate_expression(node.get("op1"))
         right = self.evaluate_expression(node.get("op2"))
+        return self.binary_operation(node.elem_type, left, right)
 
-        if (node.elem_type == "+"):
-            if (not (type(left) == type(right) and type(left) in [str, int] and type(right) in [str, int]) and 
-                not (type(left) in [int, bool] and type(right) in [int, bool])):
-                super().error(ErrorType.TYPE_ERROR, "Incompatible types for arithmetic operation")
-            return left + right
-        else:
-            if not (type(left) in [int, bool] and type(right) in [int, bool]):
-                super().error(ErrorType.TYPE_ERROR, "Incompatible types for arithmetic operation")
-
-            if (node.elem_type == "-"):
-                return left - right
-            elif (node.elem_type == "*"):
-                return left * right
-            elif (node.elem_type == "/"):
-                return left // right
-        
-    def do_logical(self, node):
-        left = self.evaluate_expression(node.get("op1"))
-        right = self.evaluate_expression(node.get("op2"))
+    def binary_operation(self, op, left, right):
+        handler = BINARY_OPERATIONS.get((op, type(left), type(right)))
+        if handler is None:
+            super().error(ErrorType.TYPE_ERROR, OPERATION_ERRORS.get(op, f"Incompatible operator {op} for types"))
+        return handler(left, right)
 
-        if (type(left) in [int]): 
-            left = True if left != 0 else False
-        if (type(right) in [int]): 
-            right = True if right != 0 else False
-
-        if type(left) not in [bool] or type(right) not in [bool]:
-            super().error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation")
-
-        if (node.elem_type == "||"):
-            return left or right
-        elif (node.elem_type == "&&"):
-            return left and right
-
-    def do_unary(self, node):
-        op = self.evaluate_expression(node.get("op1"))
-        if (node.elem_type == self.NEG_DEF):
-            if (not type(op) in [int]):
-                super().error(ErrorType.TYPE_ERROR, "Expected integer type for negation operator")
-            return -op
-        elif (node.elem_type == "!"):
-            if (not type(op) in [bool, int]):
-                super().error(ErrorType.TYPE_ERROR, "Expected bool/int type for not operator")
-            return not op
-        
-    def do_comparison(self, node):
+    def do_short_circuit_operation(self, node):
+        op = node.elem_type
         left = self.evaluate_expression(node.get("op1"))
-        right = self.evaluate_expression(node.get("op2"))
-        if node.elem_type in ["==", "!="]:
-            if (type(left) in [int] and type(right) in [bool]): 
-                left = True if left != 0 else False
-            if (type(left) in [bool] and type(right) in [int]): 
-                right = True if right != 0 else False
-
-            if (type(left) in [list] and type(right) in [list]):
-                return left is right if node.elem_type == "==" else left is not right
-
-            if (node.elem_type == "=="):
-                return (left == right)
-            elif (node.elem_type == "!="):
-                return (left != right)
-        
-        if not (type(left) in [int] and type(right) in [int]):
-            super().error(ErrorType.TYPE_ERROR, f"Incompatible operator {node.elem_type} for types")
-        
-        if (node.elem_type == "<"):
-            return left < right
-        elif (node.elem_type == "<="):
-            return left <= right
-        elif (node.elem_type == ">"):
-            return left > right
-        elif (node.elem_type == ">="):
-            return left >= right
+        if self.logical_operand(op, left) == SHORT_CIRCUIT_RESULTS[op]:
+            return SHORT_CIRCUIT_RESULTS[op]
+        return self.binary_operation(op, left, self.evaluate_expression(node.get("op2")))
+
+    # Truth value of an operand of && or ||
+    def logical_operand(self, op, value):
+        if type(value) not in NUMERIC_TYPES:
+            super().error(ErrorType.TYPE_ERROR, OPERATION_ERRORS[op])
+        return bool(value)
+
+    def do_unary_operation(self, node):
+        return self.unary_operation(node.elem_type, self.evaluate_expression(node.get("op1")))
+
+    def unary_operation(self, op, value):
+        handler = UNARY_OPERATIONS.get((op, type(value)))
+        if handler is None:
+            super().error(ErrorType.TYPE_ERROR, OPERATION_ERRORS[op])
+        return handler(value)
+
+    # var_name is the dotted name split into parts (a fresh list; 'this' is substituted in place)
+    def read_variable(self, var_name, lambda_scope_index = -1, use_proto = False):
+        if var_name[0] == "this" and self.this is not None:
+            var_name[0] = self.this
+        val = self.get_variable_value(var_name[0], None, lambda_scope_index)
+
+        if (len(var_name) == 2):
+            if type(val) not in [list]:
+                super().error(ErrorType.TYPE_ERROR, f"Invalid use of . operator with {'.'.join(var_name)}")
+            
+            if (var_name[1] == "proto" and use_proto):
+                if (val[0] is None):
+                    super().error(ErrorType.NAME_ERROR, f"Field {'.'.join(var_name)} not defined")
+                return val[0]
+
+            found_member = False
+            searching = True
+            curr_scope = val
+            while searching:
+                if var_name[1] in curr_scope[1]:
+                    found_member = True
+                    searching = False
+
+                    val = curr_scope[1][var_name[1]]
+                    break
+                elif curr_scope[0] is not None:
+                    curr_scope = curr_scope[0]
+                else:
+                    searching = False
+            
+            if not found_member:
+                super().error(ErrorType.NAME_ERROR, f"Function/Field {var_name[0]}.{var_name[1]} not found")
+
+        return val
+
+    def make_closure(self, node):
+        # Capture primitives the lambda can reference (everything if the analysis gave up),
+        # flattened into one scope; inner scopes overwrite outer ones, matching lookup order
+        captured_names = self.lambda_captures.get(node)
+        lambda_saved_scope = {}
+        for scope in self.variable_name_to_value:
+            keys = scope.keys() if captured_names is None else captured_names.intersection(scope)
+            for key in keys:
+                if type(scope[key]) in [int, bool, str]:
+                    lambda_saved_scope[key] = scope[key]
+
+        return Closure(node, [lambda_saved_scope])
 
     def evaluate_expression(self, node, lambda_scope_index = -1, use_proto = False):
-        if (node is None or node.elem_type == self.NIL_DEF):
+        if (node is None):
             return None
+        elem_type = node.elem_type
+        # If an operator, dispatch on the operand types
+        if (elem_type in BINARY_OPERATORS):
+            return self.do_binary_operation(node)
         # If a value, return value
-        elif (node.elem_type in ["int", "string", "bool"]):
+        elif (elem_type in LITERAL_TYPES):
             return node.get("val")
         # If a variable, return the value of the variable
-        elif (node.elem_type == self.VAR_DEF): 
-            var_name = self.get_name(node)
-            if var_name[0] == "this" and self.this is not None:
-                var_name[0] = self.this
-            val = self.get_variable_value(var_name[0], None, lambda_scope_index)
-
-            if (len(var_name) == 2):
-                if type(val) not in [list]:
-                    super().error(ErrorType.TYPE_ERROR, f"Invalid use of . operator with {'.'.join(var_name)}")
-                
-                if (var_name[1] == "proto" and use_proto):
-                    if (val[0] is None):
-                        super().error(ErrorType.NAME_ERROR, f"Field {'.'.join(var_name)} not defined")
-                    return val[0]
-
-                found_member = False
-                searching = True
-                curr_scope = val
-                while searching:
-                    if var_name[1] in curr_scope[1]:
-                        found_member = True
-                        searching = False
-
-                        val = curr_scope[1][var_name[1]]
-                        break
-                    elif curr_scope[0] is not None:
-                        curr_scope = curr_scope[0]
-                    else:
-                        searching = False
-                
-                if not found_member:
-                    super().error(ErrorType.NAME_ERROR, f"Function/Field {var_name[0]}.{var_name[1]} not found")
-
-            return val
-        # If object assignment
-        elif (node.elem_type == self.OBJ_DEF):
-            return [None, dict()]
-        # If lambda definition
-        elif (node.elem_type == self.LAMBDA_DEF):
-            lambda_saved_scopes = []
-            for scope in self.variable_name_to_value:
-                curr_lambda_scope = {}
-                for key in scope.keys():
-                    if type(scope[key]) in [int, bool, str]:
-                        curr_lambda_scope[key] = copy.deepcopy(scope[key])
-
-                lambda_saved_scopes.append(curr_lambda_scope)
-            
-            return (node, lambda_saved_scopes)
+        elif (elem_type == self.VAR_DEF): 
+            return self.read_variable(self.get_name(node), lambda_scope_index, use_proto)
         # If function call
-        elif (node.elem_type == self.FCALL_DEF):
+        elif (elem_type == self.FCALL_DEF):
             return self.do_func_call(node)
         # If member function call
-        elif (node.elem_type == self.MCALL_DEF):
+        elif (elem_type == self.MCALL_DEF):
             return self.do_member_call(node)
-        # If addition or subtraction
-        elif (node.elem_type in ["+", "-", "*", "/"]):
-            return self.do_arithmetic(node)
-
-        elif (node.elem_type in ["==", "!=", "<", "<=", ">=", ">"]):
-            return self.do_comparison(node)
-        
-        elif (node.elem_type in ["||", "&&"]):
-            return self.do_logical(node)
-        
-        elif (node.elem_type in [self.NEG_DEF, "!"]):
-            return self.do_unary(node)
+        elif (elem_type in UNARY_OPERATORS):
+            return self.do_unary_operation(node)
+        # If object assignment
+        elif (elem_type == self.OBJ_DEF):
+            return [None, dict()]
+        # If lambda definition
+        elif (elem_type == self.LAMBDA_DEF):
+            return self.make_closure(node)
         
         return None
     
+    # Copy for pass/return by value: primitives are immutable and closures share their
+    # function node, so only captured scopes and objects need fresh storage
+    def copy_value(self, val):
+        if type(val) in self.PRIMITIVE_TYPES:
+            return val
+        if type(val) in [tuple]:
+            return val
+        if type(val) in [Closure]:
+            memo = {}
+            return Closure(val.func, [{key: (scope[key] if type(scope[key]) in self.PRIMITIVE_TYPES else copy.deepcopy(scope[key], memo))
+                                       for key in scope} for scope in val.scopes])
+        return copy.deepcopy(val)
+
     def get_name(self, node):
         return node.get("name").split(".")
 
     def handle_proto(self, stat):
-        names = self.get_name(stat)
-
-        source_node = stat.get("expression")
-        resulting_value = self.evaluate_expression(source_node, -1, True)
+        self.assign_proto(self.get_name(stat), self.evaluate_expression(stat.get("expression"), -1, True))
 
+    def assign_proto(self, names, resulting_value):
         # Handle setting to nil
         if (resulting_value is None):
             for scope in reversed(self.variable_name_to_value):
@@ -238,19 +444,18 @@ class Interpreter(InterpreterBase):
 
     def do_assignment(self, stat, lambda_scope_index = -1):
         names = self.get_name(stat)
+        if (len(names) >= 2 and names[1] == "proto"):
+            self.handle_proto(stat)
+            return
+
+        self.assign_value(names, self.evaluate_expression(stat.get("expression")), lambda_scope_index)
+
+    # names is the dotted target split into parts (a fresh list; 'this' is substituted in place)
+    def assign_value(self, names, resulting_value, lambda_scope_index = -1):
         if names[0] == "this" and self.this is not None:
             names[0] = self.this
         target_var_name = names[0]
-
-        member_name = None
-        if (len(names) >= 2):
-            member_name = names[1]
-            if member_name == "proto":
-                self.handle_proto(stat)
-                return
-
-        source_node = stat.get("expression")
-        resulting_value = self.evaluate_expression(source_node)
+        member_name = names[1] if len(names) >= 2 else None
 
         # Doing initial assignment
         assigned = False
@@ -300,56 +505,113 @@ class Interpreter(InterpreterBase):
                 if target_var_name in scope:
                     scope[target_var_name][-1][member_name] = resulting_value
 
+    def evaluate_condition(self, stat, construct):
+        return self.to_condition(self.evaluate_expression(stat.get('condition')), construct)
+
+    def to_condition(self, cond, construct):
+        if (type(cond) in [int]):
+            cond = True if cond != 0 else False
+        if (not type(cond) in [bool]):
+            super().error(ErrorType.TYPE_ERROR, f"Expected boolean/integer input in {construct}, got {cond}")
+        return cond
+
     def do_while(self, stat, lambda_scope_index):
         self.variable_name_to_value.append({})
+        statements = stat.get("statements") or []
 
-        while (True):
-            cond = self.evaluate_expression(stat.get('condition'))
-            if (type(cond) in [int]):
-                cond = True if cond != 0 else False
-            if (not type(cond) in [bool]):
-                super().error(ErrorType.TYPE_ERROR, f"Expected boolean/integer input in while, got {cond}")
+        loop = self.enter_counted_loop(stat)
+        if loop is not None:
+            ret = self.run_counted_loop(loop, statements[:-1], lambda_scope_index)
+            self.variable_name_to_value.pop()
+            return ret
 
-            if (not cond):
+        while (True):
+            if (not self.evaluate_condition(stat, "while")):
                 break
     
-            for statement in stat.get("statements") or []:
+            for statement in statements:
                 ret = self.run_statement(statement, lambda_scope_index)
-        
-                if (self.return_flg[-1]):
+                if ret is not None:
                     self.variable_name_to_value.pop()
                     return ret
             
         self.variable_name_to_value.pop()
 
+    # The innermost scope holding var_name, or None if it is not a variable
+    def find_scope(self, var_name):
+        for scope in reversed(self.variable_name_to_value):
+            if var_name in scope:
+                return scope
+        return None
+
+    # Binds a counted loop (see brewanalyze.counted_loops) to the scopes holding its counter and bound,
+    # or returns None if it has to run through the general path: not a counted loop, a counter that
+    # is ref-linked (assignments must propagate), or names that are not variables yet. Nothing inside
+    # the loop can shadow either name, so the scopes stay the innermost ones for the whole loop.
+    def enter_counted_loop(self, stat):
+        spec = self.counted_loops.get(stat)
+        if spec is None:
+            return None
+        counter, _, bound_name = spec[:3]
+        if any(counter in mapping for mapping in self.ref_mapping):
+            return None
+        counter_scope = self.find_scope(counter)
+        bound_scope = self.find_scope(bound_name) if bound_name is not None else None
+        if counter_scope is None or (bound_name is not None and bound_scope is None):
+            return None
+        return CountedLoop(spec, counter_scope, bound_scope)
+
+    def run_counted_loop(self, loop, statements, lambda_scope_index):
+        while self.counted_loop_test(loop):
+            for statement in statements:
+                ret = self.run_statement(statement, lambda_scope_index)
+                if ret is not None:
+                    return ret
+            self.counted_loop_step(loop, lambda_scope_index)
+        return None
+
+    # The loop condition; callees may still have assigned the counter or bound a non-int through dynamic
+    # scoping, in which case the general operation decides
+    def counted_loop_test(self, loop):
+        value = loop.counter_scope[loop.counter]
+        bound = loop.bound_scope[loop.bound_name] if loop.bound_scope is not None else loop.bound
+        if type(value) is int and type(bound) is int:
+            return BINARY_OPERATIONS[(loop.op, int, int)](value, bound)
+        return self.to_condition(self.binary_operation(loop.op, value, bound), "while")
+
+    # The loop's final counter = counter +/- step statement
+    def counted_loop_step(self, loop, lambda_scope_index):
+        value = loop.counter_scope[loop.counter]
+        if type(value) is int:
+            loop.counter_scope[loop.counter] = value + loop.step if loop.step_op == "+" else value - loop.step
+        else:
+            self.assign_value([loop.counter], self.binary_operation(loop.step_op, value, loop.step), lambda_scope_index)
+
     def do_conditional(self, stat, lambda_scope_index):
         self.variable_name_to_value.append({})
-        
-        cond = self.evaluate_expression(stat.get('condition'))
-        if (type(cond) in [int]):
-            cond = True if cond != 0 else False
-        if (not type(cond) in [bool]):
-            super().error(ErrorType.TYPE_ERROR, f"Expected boolean/integer input in for, got {cond}")
 
-        to_execute = "statements" if cond else "else_statements"
+        to_execute = "statements" if self.evaluate_condition(stat, "for") else "else_statements"
         for statement in stat.get(to_execute) or []:
             ret = self.run_statement(statement, lambda_scope_index)
-        
-            if (self.return_flg[-1]):
+            if ret is not None:
                 self.variable_name_to_value.pop()
                 return ret
 
         self.variable_name_to_value.pop()
 
-    def do_input(self, params):
-        if (len(params) > 1):
-            super().error(ErrorType.NAME_ERROR, f"No input() function found that takes > 1 parameter")
-        elif (len(params) == 1):
-            super().output(self.evaluate_expression(params[0]))
+    # Core builtins, registered in __init__; inputi and inputs take an optional prompt
+    def do_input(self, prompt):
+        if (len(prompt) == 1):
+            super().output(prompt[0])
         return super().get_input()
 
-    def printValues(self, params):
-        vals = [self.evaluate_expression(p) for p in params]
+    def input_int(self, *prompt):
+        return int(self.do_input(prompt))
+
+    def input_string(self, *prompt):
+        return str(self.do_input(prompt))
+
+    def print_values(self, *vals):
         super().output(''.join([str(val).lower() if type(val) in [bool] else str(val) for val in vals]))
         return None
     
@@ -379,11 +641,10 @@ class Interpreter(InterpreterBase):
         
         if not found_member:
             super().error(ErrorType.NAME_ERROR, f"Function {stat.get('objref')}.{stat.get('name')}(...) not found")
-        if type(possible_func_info) not in [tuple]:
+        possible_func = self.get_callable_node(possible_func_info)
+        if possible_func is None:
             super().error(ErrorType.TYPE_ERROR, f"Invalid call to member variable {stat.get('objref')}.{stat.get('name')}")
 
-        possible_func = possible_func_info[0]
-
         if possible_func.elem_type == self.FUNC_DEF:
             # Function member
             func = possible_func
@@ -400,55 +661,63 @@ class Interpreter(InterpreterBase):
 
         elif possible_func.elem_type == self.LAMBDA_DEF:
             # Lambda member
-            func = possible_func_info[0]
-            scope = possible_func_info[1]
-
-            args = stat.get('args')
-
-            # Running code
-            vars_before = copy.deepcopy(self.variable_name_to_value)
-            self.variable_name_to_value += scope
-
             curr_obj = stat.get('objref')
             update_this = (curr_obj != 'this')
             if update_this:
                 temp = self.this
                 self.this = curr_obj
-            ret = self.run_func(func, args, len(vars_before))
+            ret = self.run_lambda_func(possible_func_info, stat.get('args'))
             if update_this:
                 self.this = temp
 
-            # Updating lambda scope for future calls
-            lambda_scope = self.variable_name_to_value[len(vars_before):]
-            self.variable_name_to_value = self.variable_name_to_value[:len(vars_before)]
-            obj[-1][stat.get('name')] = (func, lambda_scope)
-
         return ret
 
     def do_func_call(self, stat):
         params = stat.get("args")
-        if stat.get("name") == "inputi":
-            return int(self.do_input(params))
-        elif stat.get("name") == "inputs":
-            return str(self.do_input(params))
-        elif (stat.get("name") == "print"):
-            self.printValues(params)
-            return
+        builtin = (self.program_builtins.get((stat.get("name"), len(params or []))) or
+                   self.program_builtins.get((stat.get("name"), None)))
+        if builtin is not None:
+            return self.call_builtin(builtin, [self.evaluate_expression(param) for param in params or []])
         else:
             possible_func_info = self.get_variable_value(stat.get("name"), len(params or []))
-            possible_func = possible_func_info[0]
+            possible_func = self.get_callable_node(possible_func_info)
             if (possible_func.elem_type == self.FUNC_DEF and 
                 (possible_func.get("name"), len(possible_func.get("args"))) in self.function_name_to_node):
+                if (possible_func.get("name"), len(possible_func.get("args"))) in self.pure_functions:
+                    return self.run_memoized_func((possible_func.get("name"), len(possible_func.get("args"))), params)
                 return self.run_func(self.function_name_to_node[(possible_func.get("name"), len(possible_func.get("args")))][0], params)
             elif (possible_func.elem_type == self.LAMBDA_DEF and 
                   len(possible_func.get('args')) == len(params)):
-                return self.run_lambda_func(possible_func, params, possible_func_info[1], stat.get("name"))
+                return self.run_lambda_func(possible_func_info, params)
 
         super().error(ErrorType.NAME_ERROR, f"No function found with name {stat.get('name')}")
     
     def load_functions(self, ast):
         for func in ast.get("functions"):
             self.function_name_to_node[(func.get("name"), len(func.get('args')))] = (func,)
+        self.lambda_captures = lambda_free_variables(ast)
+        self.build_program_tables(ast)
+        if self.short_circuit:
+            for func_name, op, effect in short_circuit_hazards(ast):
+                print(f"WARNING: {op} in {func_name}() skips a right operand with a side effect ({effect}) "
+                      "when it short-circuits", file=sys.stderr)
+
+    # Tables derived from the loaded program and its function table: the builtins it does not hide, and
+    # the analyses that drive memoization and counted loops
+    def build_program_tables(self, ast):
+        # A function or variable defined by the program hides a native builtin of the same name
+        defined_names = {name for name, _ in self.function_name_to_node} | variable_names(ast)
+        self.program_builtins = {key: builtin for key, builtin in self.builtins.items()
+                                 if key[0] in BUILTIN_FUNCS or key[0] not in defined_names}
+        self.loaded_program = ast
+        self.isolated_callables = None
+        if self.memo_cache is not None:
+            self.pure_functions = pure_functions(ast)
+        if self.SPECIALIZE_LOOPS:
+            self.counted_loops = counted_loops(ast)
+
+    def get_memo_stats(self):
+        return self.memo_cache.stats() if self.memo_cache is not None else None
 
     def get_main_func_node(self, ast):
         main = [func for func in ast.get("functions") if func.get("name") == "main"]
@@ -457,6 +726,7 @@ class Interpreter(InterpreterBase):
 
         return main[0]
 
+    # Returns None on normal completion, or a ReturnSignal when a return statement was executed
     def run_statement(self, stat, lambda_scope_index = -1):
         if stat.elem_type == "=":
             self.do_assignment(stat, lambda_scope_index)
@@ -469,27 +739,97 @@ class Interpreter(InterpreterBase):
         elif stat.elem_type == self.WHILE_DEF:
             return self.do_while(stat, lambda_scope_index)
         elif stat.elem_type == self.RETURN_DEF:
-            self.return_flg[-1] = True
-            return copy.deepcopy(self.evaluate_expression(stat.get("expression")))
+            return ReturnSignal(self.copy_value(self.evaluate_expression(stat.get("expression"))))
 
-    def run_lambda_func(self, func, args, scope, var_name):
-        vars_before = copy.deepcopy(self.variable_name_to_value)
-        self.variable_name_to_value += scope
+    def run_lambda_func(self, closure, args):
+        # Captured scopes are pushed by reference, so the body updates the closure in place
+        scope_index = len(self.variable_name_to_value)
+        self.variable_name_to_value += closure.scopes
 
-        ret = self.run_func(func, args, len(vars_before))
-        
-        # Updating lambda scope for future calls
-        lambda_scope = self.variable_name_to_value[len(vars_before):]
-        self.variable_name_to_value = self.variable_name_to_value[:len(vars_before)]
+        ret = self.run_func(closure.func, args, scope_index)
 
-        for scope in reversed(self.variable_name_to_value):
-            if var_name in scope:
-                scope[var_name] = (scope[var_name][0], lambda_scope)
-                break
+        del self.variable_name_to_value[scope_index:]
+        return ret
 
+    # Calls a pure function through the memo cache when the call is isolated: primitive arguments only,
+    # and none of the function's guard names bound in the current scopes
+    def run_memoized_func(self, func_key, args):
+        func = self.function_name_to_node[func_key][0]
+        arg_values = [self.copy_value(self.evaluate_expression(arg)) for arg in args]
+
+        guard = self.pure_functions[func_key]
+        if (any(type(val) not in self.PRIMITIVE_TYPES for val in arg_values) or
+            any(not guard.isdisjoint(scope) for scope in self.variable_name_to_value)):
+            self.memo_cache.bypasses += 1
+            return self.run_func(func, args, arg_values=arg_values)
+
+        # Include types so that e.g. f(1) and f(true) do not share an entry
+        key = (func_key, tuple((type(val), val) for val in arg_values))
+        found, ret = self.memo_cache.lookup(key)
+        if found:
+            return ret
+        ret = self.run_func(func, args, arg_values=arg_values)
+        if type(ret) in self.PRIMITIVE_TYPES:
+            self.memo_cache.store(key, ret)
         return ret
 
-    def run_func(self, func, args, lambda_scope_index = -1):
+    # Calls a function value (see get_callable_node) with already evaluated arguments
+    def call_value(self, val, arg_values):
+        func = self.get_callable_node(val)
+        args = [Element(self.NIL_DEF) for _ in arg_values]
+        arg_values = [self.copy_value(arg) for arg in arg_values]
+        if type(val) is not Closure:
+            func = self.function_name_to_node[(func.get("name"), len(func.get("args")))][0]
+            return self.run_func(func, args, arg_values=arg_values)
+        scope_index = len(self.variable_name_to_value)
+        self.variable_name_to_value += val.scopes
+        ret = self.run_func(func, args, scope_index, arg_values)
+        del self.variable_name_to_value[scope_index:]
+        return ret
+
+    # pmap(f, start, end, consume) calls consume(i, f(i)) for every i from start up to (not including) end,
+    # in order. When f can be called in isolation (see brewanalyze.isolated_callables) and none of its
+    # guard names is bound, the f(i) of a long enough range are computed up front by worker processes;
+    # f cannot observe the difference, and results that are not primitive values are recomputed here.
+    def parallel_map(self, func, start, end, consume):
+        self.check_callable(func, "pmap", 1)
+        self.check_callable(consume, "pmap", 2)
+        results = None
+        processes = self.parallel_processes or os.cpu_count() or 1
+        if end - start >= self.PARALLEL_MAP_MIN and processes > 1:
+            results = self.map_in_workers(func, list(range(start, end)), processes)
+
+        for index, arg in enumerate(range(start, end)):
+            if results is None:
+                ret = self.call_value(func, [arg])
+            else:
+                completed, ret = results[index]
+                if not completed:
+                    error_type, exception = ret
+                    if error_type is None:
+                        raise exception
+                    super().error(error_type, str(exception).partition(": ")[2])
+                if type(ret) not in self.PRIMITIVE_TYPES:
+                    ret = self.call_value(func, [arg])
+            self.call_value(consume, [arg, ret])
+        return None
+
+    # Returns brewparallel.parallel_map's results for func over args, or None if func is not isolated
+    def map_in_workers(self, func, args, processes):
+        if self.isolated_callables is None:
+            self.isolated_callables = isolated_callables(self.loaded_program)
+        node = self.get_callable_node(func)
+        guard = self.isolated_callables.get(node)
+        scopes = self.variable_name_to_value + (func.scopes if type(func) is Closure else [])
+        if guard is None or any(not guard.isdisjoint(scope) for scope in scopes):
+            return None
+        functions = [func_node for func_node in self.loaded_program.get("functions")
+                     if func_node in self.isolated_callables]
+        target = Closure(node, []) if type(func) is Closure else (node,)
+        return parallel_map(functions, target, args, processes, options={"native_builtins": self.native_builtins})
+
+    # arg_values, if given, are the already evaluated and copied by-value arguments
+    def run_func(self, func, args, lambda_scope_index = -1, arg_values = None):
         if self.trace_output:
             print(f'\nCALLING {func.get("name")}: ')
             self.dump_vars()
@@ -501,15 +841,15 @@ class Interpreter(InterpreterBase):
 
         # Loading args
         arg_mapping = list(zip(func.get("args"), args))
-        for param, val in arg_mapping:
+        for index, (param, val) in enumerate(arg_mapping):
+            if arg_values is not None:
+                params[param.get('name')] = arg_values[index]
+                continue
             evaluated_val = self.evaluate_expression(val, lambda_scope_index)
             if (param.elem_type == self.REFARG_DEF):
                 params[param.get('name')] = evaluated_val
             else:
-                if (type(evaluated_val) in [tuple]):
-                    params[param.get('name')] = (copy.deepcopy(evaluated_val[0]), copy.deepcopy(evaluated_val[1])) 
-                else:
-                    params[param.get('name')] = copy.deepcopy(evaluated_val) 
+                params[param.get('name')] = self.copy_value(evaluated_val)
 
         self.variable_name_to_value.append(params)
 
@@ -533,13 +873,7 @@ class Interpreter(InterpreterBase):
         self.ref_mapping.append(curr_ref_mapping)
 
 
-        self.return_flg.append(False)
-        ret = None
-        for statement in func.get("statements"):
-            ret = self.run_statement(statement, lambda_scope_index)
-        
-            if (self.return_flg[-1]):
-                break
+        ret = self.run_body(func, lambda_scope_index)
 
         if self.trace_output:
             print(f'After Function {func.get("name")}: ')
@@ -564,15 +898,180 @@ class Interpreter(InterpreterBase):
         if self.trace_output:
             print(f'Ending {func.get("name")}: ')
             self.dump_vars()
-        self.return_flg.pop()
 
-        return ret        
+        return ret
 
-    def run(self, program):
-        parsed_program = parse_program(program)
+    # Runs a function or lambda body; returns its return value (None if it falls off the end)
+    def run_body(self, func, lambda_scope_index):
+        for statement in func.get("statements"):
+            ret = self.run_statement(statement, lambda_scope_index)
+            if ret is not None:
+                return ret.value
+        return None
+
+    # Resumable execution of main's own statements. main_path holds one [statement_index, block_key]
+    # frame per block being executed inside main, where block_key names the statement list of the
+    # enclosing if/while. Between two main-level statements no Python frames beyond this executor are
+    # live, so the frames plus the data state fully describe where execution is.
+    def run_block_resumable(self, statements, depth):
+        frame = self.main_path[depth]
+        while frame[0] < len(statements):
+            stat = statements[frame[0]]
+            if len(self.main_path) == depth + 1:
+                self.statements_since_checkpoint += 1
+                if self.statements_since_checkpoint >= self.checkpoint_every:
+                    self.save_checkpoint()
+                ret = self.start_statement_resumable(stat, depth)
+            else:
+                ret = self.continue_statement_resumable(stat, depth)
+            if ret is not None:
+                return ret
+            frame[0] += 1
+        return None
+
+    def start_statement_resumable(self, stat, depth):
+        if stat.elem_type == self.IF_DEF:
+            self.variable_name_to_value.append({})
+            to_execute = "statements" if self.evaluate_condition(stat, "for") else "else_statements"
+            self.main_path.append([0, to_execute])
+            return self.continue_statement_resumable(stat, depth)
+        elif stat.elem_type == self.WHILE_DEF:
+            self.variable_name_to_value.append({})
+            if (not self.evaluate_condition(stat, "while")):
+                self.variable_name_to_value.pop()
+                return None
+            self.main_path.append([0, "statements"])
+            return self.continue_statement_resumable(stat, depth)
+        return self.run_statement(stat)
+
+    # Finishes the if/while at main_path[depth] whose body frame is main_path[depth + 1]
+    def continue_statement_resumable(self, stat, depth):
+        body = self.main_path[depth + 1]
+        while True:
+            ret = self.run_block_resumable(stat.get(body[1]) or [], depth + 1)
+            if ret is not None or stat.elem_type == self.IF_DEF or not self.evaluate_condition(stat, "while"):
+                break
+            body[0] = 0
+        self.main_path.pop()
+        self.variable_name_to_value.pop()
+        return ret
+
+    def run_main_resumable(self):
+        self.run_block_resumable(self.get_main_func_node(self.parsed_program).get("statements"), 0)
+        self.ref_mapping.pop()
+        self.variable_name_to_value.pop()
+
+    def save_checkpoint(self, path=None):
+        path = path or self.checkpoint_path.format(n=self.checkpoint_count)
+        state = {
+            "version": self.CHECKPOINT_VERSION,
+            "program": self.parsed_program,
+            "functions": self.function_name_to_node,
+            "lambda_captures": self.lambda_captures,
+            "variables": self.variable_name_to_value,
+            "ref_mapping": self.ref_mapping,
+            "this": self.this,
+            "main_path": self.main_path,
+            "inp": self.inp,
+            "input_cursor": self.input_cursor,
+            "output_log": self.output_log,
+        }
+        # A single dump keeps AST nodes, objects and closures shared exactly as they are at runtime
+        with gzip.open(path, "wb") as handle:
+            pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.checkpoint_count += 1
+        self.statements_since_checkpoint = 0
+
+    def load_checkpoint(self, path):
+        with gzip.open(path, "rb") as handle:
+            state = pickle.load(handle)
+        if state.get("version") != self.CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')}")
+
+        self.parsed_program = state["program"]
+        self.function_name_to_node = state["functions"]
+        self.lambda_captures = state["lambda_captures"]
+        self.build_program_tables(state["program"])
+        self.variable_name_to_value = state["variables"]
+        self.ref_mapping = state["ref_mapping"]
+        self.this = state["this"]
+        self.main_path = state["main_path"]
+        self.inp = state["inp"]
+        self.input_cursor = state["input_cursor"]
+        self.output_log = state["output_log"]
+
+    # Continue a program from a checkpoint written by save_checkpoint
+    def resume(self, path):
+        self.load_checkpoint(path)
+        self.statements_since_checkpoint = 0
+        self.run_main_resumable()
+        return self.parsed_program
+
+    # Returns a program with the functions of every unit the given one includes, directly or not, followed
+    # by its own. Included units come before the units including them, so a unit's own definitions win
+    # over those of the units it includes; each unit is linked once, main functions of included units
+    # are left out, and a unit that ends up including itself is an error.
+    def link_units(self, unit):
+        self.unit_hashes = {}
+        if not unit.get("includes"):
+            return unit
+        functions = []
+        self.collect_unit_functions(unit, self.include_root(), functions)
+        functions.extend(unit.get("functions"))
+        return Element(self.PROGRAM_DEF, functions=functions)
+
+    def include_root(self):
+        return os.path.abspath(self.include_dir or os.getcwd())
+
+    def collect_unit_functions(self, unit, directory, functions, including=()):
+        for include in unit.get("includes") or []:
+            path = os.path.normpath(os.path.join(directory, include.get("path")))
+            if path in including:
+                super().error(ErrorType.NAME_ERROR, f"Unit {include.get('path')} includes itself")
+            if path in self.unit_hashes:
+                continue
+            try:
+                with open(path, encoding="utf-8") as handle:
+                    source = handle.read()
+            except OSError:
+                super().error(ErrorType.NAME_ERROR, f"Unit {include.get('path')} could not be loaded")
+            self.unit_hashes[path] = hashlib.sha256(source.encode("utf-8")).hexdigest()
+            included = UNIT_CACHE.get(source)
+            self.collect_unit_functions(included, os.path.dirname(path), functions, including + (path,))
+            functions.extend(func for func in included.get("functions") if func.get("name") != "main")
+
+    # Parses the program (reusing cached units), links the units it includes and prepares the function
+    # table; returns the AST
+    def load_program(self, program):
+        parsed_program = self.link_units(UNIT_CACHE.get(program))
         if (self.trace_output):
             print(parsed_program)
         self.load_functions(parsed_program)
+        return parsed_program
+
+    # Clears the runtime state as well as I/O, so a loaded program can be run again (see run_loaded);
+    # function tables, analyses, the memo cache and the checkpoint options are kept
+    def reset(self):
+        super().reset()
+        self.variable_name_to_value = []
+        self.ref_mapping = []
+        self.this = None
+        self.main_path = []
+        self.statements_since_checkpoint = 0
+
+    def run(self, program):
+        parsed_program = self.load_program(program)
+        self.run_loaded(parsed_program)
+        return parsed_program
+
+    # Runs main of a program returned by load_program
+    def run_loaded(self, parsed_program):
         main_func_node = self.get_main_func_node(parsed_program)
-        self.run_func(main_func_node, [])
-        return parsed_program
\ No newline at end of file
+        if self.checkpoint_path is None:
+            self.run_func(main_func_node, [])
+        else:
+            self.parsed_program = parsed_program
+            self.variable_name_to_value.append({})
+            self.ref_mapping.append({})
+            self.main_path = [[0, "statements"]]
+            self.run_main_resumable()
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Peak-memory benchmark for the Brewin interpreters.
+
+Runs Brewin programs under tracemalloc and reports peak and retained (after the run, with the
+interpreter still alive) memory, broken down by what holds it: AST nodes, scope dicts, closure
+captures, objects and the output log; "other" is the rest of the traced memory (Python frames,
+temporaries, interpreter tables). The breakdown is taken from the interpreter's own structures
+whenever traced memory reaches a new high, so the peak breakdown is that of the highest sample.
+
+The categories are not tracemalloc statistics grouped by allocation site, which cannot tell them
+apart: a closure's captured dicts are also the scopes of its calls, and copies of values are made by
+the same lines whatever holds them. Instead, each object's sys.getsizeof is counted under the
+structure that holds it.
+
+usage: python3 memorybench.py [-m MODULE] [--budget SIZE] [--category-budget CATEGORY=SIZE ...] [FILE ...]
+
+Without files, the microbench programs are used. Sizes take K and M suffixes (1K = 1024 bytes). With
+budgets, the exit status is 1 if any program's peak (or a category of its peak) exceeds one.
+"""
+
+import argparse
+import gc
+import importlib
+import sys
+import tracemalloc
+
+from element import Element
+from microbench import PROGRAMS, program_options
+
+CATEGORIES = ["ast", "scopes", "closures", "objects", "output", "other"]
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+# Sample again once traced memory has grown by this factor since the last breakdown
+SAMPLE_GROWTH = 1.1
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1:] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def is_object(value):
+    # Brewin objects are [proto, fields] lists
+    return (type(value) is list and len(value) == 2 and type(value[1]) is dict and
+            (value[0] is None or type(value[0]) is list))
+
+
+def breakdown(interpreter, closure_type):
+    """Bytes held by each category, from the interpreter's state. Every Python object is counted once,
+    for the first category that reaches it: AST nodes anywhere count as AST, closures and objects
+    count as such wherever they are stored."""
+    sizes = dict.fromkeys(CATEGORIES[:-1], 0)
+    seen = set()
+    stack = [(getattr(interpreter, "loaded_program", None), "ast"), (interpreter.function_name_to_node, "ast"),
+             (interpreter.output_log, "output"), (interpreter.variable_name_to_value, "scopes"),
+             (getattr(interpreter, "ref_mapping", None), "scopes")]
+    while stack:
+        value, category = stack.pop()
+        if value is None or id(value) in seen:
+            continue
+        seen.add(id(value))
+        value_type = type(value)
+        if value_type is Element:
+            category = "ast"
+        elif value_type is closure_type:
+            category = "closures"
+        elif is_object(value):
+            category = "objects"
+        sizes[category] += sys.getsizeof(value)
+
+        if value_type is Element:
+            stack.append((value.dict, category))
+        elif value_type is closure_type:
+            stack.append((value.func, category))
+            stack.append((value.scopes, category))
+        elif value_type is dict:
+            stack.extend((key, category) for key in value)
+            stack.extend((item, category) for item in value.values())
+        elif value_type in (list, tuple):
+            stack.extend((item, category) for item in value)
+    return sizes
+
+
+def profiled_interpreter(interpreter_lib):
+    """Subclass of the module's Interpreter that samples traced memory after every statement and call."""
+
+    class MemoryProfiledInterpreter(interpreter_lib.Interpreter):
+        peak = 0
+        next_sample = 0
+        peak_sample = 0
+        peak_breakdown = None
+
+        def sample(self):
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if current >= self.next_sample:
+                self.peak_breakdown = breakdown(self, getattr(interpreter_lib, "Closure", None))
+                self.peak_sample = current
+                self.next_sample = current * SAMPLE_GROWTH
+                # the breakdown's own temporaries must not count towards the program's peak
+                tracemalloc.reset_peak()
+
+        def run_statement(self, *args):
+            ret = super().run_statement(*args)
+            self.sample()
+            return ret
+
+        def run_func(self, *args, **kwargs):
+            ret = super().run_func(*args, **kwargs)
+            self.sample()
+            return ret
+
+    return MemoryProfiledInterpreter
+
+
+def measure(interpreter_lib, program, **options):
+    """Return (peak, sampled peak, peak breakdown, retained, retained breakdown) in bytes, and the error if
+    the run failed. The peak breakdown adds up to the sampled peak, the highest traced memory seen between
+    statements."""
+    gc.collect()
+    tracemalloc.start()
+    error = None
+    try:
+        interpreter = profiled_interpreter(interpreter_lib)(False, [], False, **options)
+        try:
+            interpreter.run(program)
+        except Exception as exception:  # pylint: disable=broad-except
+            error = exception
+        interpreter.sample()
+        peak = max(interpreter.peak, tracemalloc.get_traced_memory()[1])
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+        retained_breakdown = breakdown(interpreter, getattr(interpreter_lib, "Closure", None))
+    finally:
+        tracemalloc.stop()
+
+    peak_breakdown = interpreter.peak_breakdown or dict.fromkeys(CATEGORIES[:-1], 0)
+    peak_breakdown["other"] = max(0, interpreter.peak_sample - sum(peak_breakdown.values()))
+    retained_breakdown["other"] = max(0, retained - sum(retained_breakdown.values()))
+    return peak, interpreter.peak_sample, peak_breakdown, retained, retained_breakdown, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brewin interpreter memory benchmark")
+    parser.add_argument("-m", "--module", default="interpreterv4")
+    parser.add_argument("--budget", type=parse_size, help="maximum peak traced memory per program")
+    parser.add_argument("--category-budget", action="append", default=[], metavar="CATEGORY=SIZE",
+                        help="maximum peak memory of one category per program")
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    category_budgets = {}
+    for budget in args.category_budget:
+        category, _, size = budget.partition("=")
+        if category not in CATEGORIES:
+            parser.error(f"unknown category {category}; expected one of {', '.join(CATEGORIES)}")
+        category_budgets[category] = parse_size(size)
+
+    programs = {}
+    for path in args.files:
+        with open(path, encoding="utf-8") as handle:
+            programs[path] = handle.read()
+    programs = programs or PROGRAMS
+
+    interpreter_lib = importlib.import_module(args.module)
+    over_budget = []
+    for name, program in programs.items():
+        options = program_options(interpreter_lib, name, {})
+        peak, sampled, peak_breakdown, retained, retained_breakdown, error = measure(interpreter_lib, program, **options)
+        status = f" (failed: {error})" if error is not None else ""
+        print(f"{name}: peak {peak / 1024:.1f} KiB (breakdown at {sampled / 1024:.1f} KiB), "
+              f"retained {retained / 1024:.1f} KiB{status}")
+        print(f"  {'category':<10}{'peak KiB':>12}{'retained KiB':>14}")
+        for category in CATEGORIES:
+            print(f"  {category:<10}{peak_breakdown[category] / 1024:>12.1f}{retained_breakdown[category] / 1024:>14.1f}")
+
+        if args.budget is not None and peak > args.budget:
+            over_budget.append(f"{name}: peak {peak} > {args.budget} bytes")
+        for category, budget in category_budgets.items():
+            if peak_breakdown[category] > budget:
+                over_budget.append(f"{name}: {category} {peak_breakdown[category]} > {budget} bytes")
+
+    if over_budget:
+        print("Over budget:")
+        for line in over_budget:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
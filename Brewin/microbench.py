@@ -0,0 +1,445 @@
+"""
+Microbenchmarks for the Brewin interpreters.
+
+Runs small loop- and call-heavy Brewin programs and reports executed statements per second.
+With --per-op, measures single operations instead (see OPERATIONS) on every available backend and
+reports nanoseconds per operation with a 95% confidence interval.
+
+usage: python3 microbench.py [-m MODULE] [-n REPEATS] [--memo SIZE] [--short-circuit] [PROGRAM ...]
+       python3 microbench.py --per-op [--samples N] [--min-time SECONDS] [OPERATION ...]
+"""
+
+import argparse
+import gc
+import importlib
+import statistics
+import time
+
+import interpreterv4
+
+# Compiled backends never call run_statement, so their statement counts come from the tree-walker
+COUNTING_MODULES = {"brewcompile": "interpreterv4"}
+# Programs that call the native builtin library (see brewbuiltins); it only exists on interpreterv4 and
+# the backends derived from it
+NATIVE_PROGRAMS = {"gcd_native", "repeat_native"}
+
+
+def program_options(interpreter_lib, name, options):
+    """Constructor options for running PROGRAMS[name]: options, plus the native builtins if it needs them."""
+    if name in NATIVE_PROGRAMS and issubclass(interpreter_lib.Interpreter, interpreterv4.Interpreter):
+        return dict(options, native_builtins=True)
+    return options
+
+PROGRAMS = {
+    "while_loop": """
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 20000) {
+    s = s + i;
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+    "nested_if": """
+func main() {
+  i = 0;
+  evens = 0;
+  while (i < 10000) {
+    if (i / 2 * 2 == i) {
+      evens = evens + 1;
+    } else {
+      evens = evens + 0;
+    }
+    i = i + 1;
+  }
+  print(evens);
+}
+""",
+    "early_return": """
+func find(n) {
+  i = 0;
+  while (true) {
+    if (i == n) {
+      return i;
+    }
+    i = i + 1;
+  }
+}
+
+func main() {
+  j = 0;
+  while (j < 200) {
+    find(50);
+    j = j + 1;
+  }
+}
+""",
+    "recursion": """
+func fib(n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+func main() {
+  print(fib(15));
+}
+""",
+    "closure_calls": """
+func apply(f, v) {
+  return f(v);
+}
+
+func main() {
+  base = 3;
+  add = lambda(x) { return x + base; };
+  i = 0;
+  s = 0;
+  while (i < 1000) {
+    s = s + apply(add, i);
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+    "closure_creation": """
+func main() {
+  v0 = 0;
+  v1 = 1;
+  v2 = 2;
+  v3 = 3;
+  v4 = 4;
+  v5 = 5;
+  v6 = 6;
+  v7 = 7;
+  v8 = 8;
+  v9 = 9;
+  v10 = 10;
+  v11 = 11;
+  v12 = 12;
+  v13 = 13;
+  v14 = 14;
+  v15 = 15;
+  v16 = 16;
+  v17 = 17;
+  v18 = 18;
+  v19 = 19;
+  v20 = 20;
+  v21 = 21;
+  v22 = 22;
+  v23 = 23;
+  v24 = 24;
+  v25 = 25;
+  v26 = 26;
+  v27 = 27;
+  v28 = 28;
+  v29 = 29;
+  v30 = 30;
+  v31 = 31;
+  v32 = 32;
+  v33 = 33;
+  v34 = 34;
+  v35 = 35;
+  v36 = 36;
+  v37 = 37;
+  v38 = 38;
+  v39 = 39;
+  i = 0;
+  s = 0;
+  while (i < 500) {
+    f = lambda(x) { return x + v1; };
+    s = s + f(i);
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+    "guarded_calls": """
+func costly(n) {
+  k = 0;
+  while (k < 10) {
+    k = k + 1;
+  }
+  return n / 2 * 2 == n;
+}
+
+func main() {
+  i = 0;
+  hits = 0;
+  while (i < 1000) {
+    if (i > 900 && costly(i)) {
+      hits = hits + 1;
+    }
+    i = i + 1;
+  }
+  print(hits);
+}
+""",
+    "gcd_brewin": """
+func euclid(a, b) {
+  while (b != 0) {
+    t = a - a / b * b;
+    a = b;
+    b = t;
+  }
+  return a;
+}
+
+func main() {
+  i = 1;
+  s = 0;
+  while (i < 300) {
+    s = s + euclid(i * 7919, 104729 - i);
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+    "gcd_native": """
+func main() {
+  i = 1;
+  s = 0;
+  while (i < 300) {
+    s = s + gcd(i * 7919, 104729 - i);
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+    "repeat_brewin": """
+func pad(s, n) {
+  r = "";
+  k = 0;
+  while (k < n) {
+    r = r + s;
+    k = k + 1;
+  }
+  return r;
+}
+
+func main() {
+  i = 0;
+  line = "";
+  while (i < 100) {
+    line = pad("ab", 20);
+    i = i + 1;
+  }
+  print(line);
+}
+""",
+    "repeat_native": """
+func main() {
+  i = 0;
+  line = "";
+  while (i < 100) {
+    line = repeat("ab", 20);
+    i = i + 1;
+  }
+  print(line);
+}
+""",
+    "object_args": """
+func total(o, n) {
+  return o.a + o.b + n;
+}
+
+func main() {
+  p = @;
+  p.a = 1;
+  p.b = 2;
+  i = 0;
+  s = 0;
+  while (i < 1000) {
+    s = s + total(p, i);
+    i = i + 1;
+  }
+  print(s);
+}
+""",
+}
+
+
+# Operations measured in isolation: (setup statements, operation statement). Each one runs in a counted
+# loop, and the same loop without it is the baseline. Expression operations are measured as an
+# assignment of the expression, so they include the cost of "assignment".
+OPERATIONS = {
+    "assignment": ("", "y = 1;"),
+    "variable_read": ("x = 1;", "y = x;"),
+    "function_call": ("", "y = f(1);"),
+    "lambda_call": ("l = lambda(a) { return a; };", "y = l(1);"),
+    "method_call": ("o = @; o.m = lambda(a) { return a; };", "y = o.m(1);"),
+    "field_read": ("o = @; o.v = 1;", "y = o.v;"),
+    "proto_lookup": ("a = @; a.v = 1; b = @; b.proto = a; c = @; c.proto = b;", "y = c.v;"),
+}
+
+# Backends timed with --per-op, when they import
+BACKENDS = ["interpreterv4", "brewcompile"]
+
+# Two-sided 95% Student t quantiles by degrees of freedom; larger samples use the normal quantile
+T_QUANTILES = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+               10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+
+def operation_program(setup, operation, iterations):
+    return f"""
+func f(a) {{
+  return a;
+}}
+
+func main() {{
+  y = 0;
+  {setup}
+  i = 0;
+  while (i < {iterations}) {{
+    {operation}
+    i = i + 1;
+  }}
+}}
+"""
+
+
+def run_once(interpreter_lib, program):
+    """Run the program once with GC paused; return the wall time in seconds."""
+    interpreter = interpreter_lib.Interpreter(False, [], False)
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        interpreter.run(program)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def calibrate(interpreter_lib, setup, min_time):
+    """Smallest power-of-two iteration count whose baseline loop runs for at least min_time seconds."""
+    iterations = 256
+    while run_once(interpreter_lib, operation_program(setup, "", iterations)) < min_time:
+        iterations *= 2
+    return iterations
+
+
+def reject_outliers(samples):
+    """Drop samples outside Tukey's fences (1.5 interquartile ranges beyond the quartiles)."""
+    if len(samples) < 4:
+        return samples
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    spread = 1.5 * (q3 - q1)
+    return [sample for sample in samples if q1 - spread <= sample <= q3 + spread]
+
+
+def confidence_interval(samples):
+    """Half-width of the 95% confidence interval of the mean."""
+    if len(samples) < 2:
+        return float("nan")
+    df = len(samples) - 1
+    quantile = T_QUANTILES[max(key for key in T_QUANTILES if key <= df)] if df <= 30 else 1.96
+    return quantile * statistics.stdev(samples) / len(samples) ** 0.5
+
+
+def measure_operation(interpreter_lib, setup, operation, samples, min_time, warmups=2):
+    """Per-operation times in seconds, one per sample, each from an interleaved pair of runs."""
+    iterations = calibrate(interpreter_lib, setup, min_time)
+    measured = operation_program(setup, operation, iterations)
+    baseline = operation_program(setup, "", iterations)
+    for _ in range(warmups):
+        run_once(interpreter_lib, measured)
+        run_once(interpreter_lib, baseline)
+    per_op = []
+    for _ in range(samples):
+        with_op = run_once(interpreter_lib, measured)
+        without_op = run_once(interpreter_lib, baseline)
+        per_op.append((with_op - without_op) / iterations)
+    return iterations, per_op
+
+
+def run_per_op(operations, samples, min_time):
+    print(f"{'backend':<16}{'operation':<16}{'ns/op':>10}{'95% CI':>10}{'samples':>10}{'iterations':>12}")
+    for backend in BACKENDS:
+        try:
+            interpreter_lib = importlib.import_module(backend)
+        except ImportError:
+            continue
+        for name in operations:
+            setup, operation = OPERATIONS[name]
+            iterations, per_op = measure_operation(interpreter_lib, setup, operation, samples, min_time)
+            kept = reject_outliers(per_op)
+            mean = statistics.fmean(kept)
+            interval = confidence_interval(kept)
+            print(f"{backend:<16}{name:<16}{mean * 1e9:>10.0f}{'±' + format(interval * 1e9, '.0f'):>10}"
+                  f"{f'{len(kept)}/{len(per_op)}':>10}{iterations:>12}")
+
+
+def count_statements(interpreter_lib, program, **options):
+    """Run the program once with an instrumented interpreter; return the number of statements executed."""
+
+    class CountingInterpreter(interpreter_lib.Interpreter):
+        statements = 0
+        # counted loops step their counter without running the increment statement
+        SPECIALIZE_LOOPS = False
+
+        def run_statement(self, *args):
+            self.statements += 1
+            return super().run_statement(*args)
+
+    interpreter = CountingInterpreter(False, [], False, **options)
+    interpreter.run(program)
+    return interpreter.statements
+
+
+def time_program(interpreter_lib, program, repeats, **options):
+    """Run the program repeats times with GC paused (as timeit does); return the best wall time in seconds."""
+    best = None
+    for _ in range(repeats):
+        interpreter = interpreter_lib.Interpreter(False, [], False, **options)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brewin interpreter microbenchmarks")
+    parser.add_argument("-m", "--module", default="interpreterv4")
+    parser.add_argument("-n", "--repeats", type=int, default=5)
+    parser.add_argument("--memo", type=int, default=0, help="memo cache size for pure functions (v4 only)")
+    parser.add_argument("--short-circuit", action="store_true", help="short-circuit && and || (v4 only)")
+    parser.add_argument("--per-op", action="store_true", help="time single operations on every backend")
+    parser.add_argument("--samples", type=int, default=20, help="samples per operation (--per-op)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="calibrate each operation's loop to run at least this many seconds (--per-op)")
+    parser.add_argument("programs", nargs="*")
+    args = parser.parse_args()
+
+    if args.per_op:
+        run_per_op(args.programs or list(OPERATIONS), args.samples, args.min_time)
+        return
+    args.programs = args.programs or list(PROGRAMS)
+
+    interpreter_lib = importlib.import_module(args.module)
+    counting_lib = importlib.import_module(COUNTING_MODULES.get(args.module, args.module))
+    options = {"memo_size": args.memo} if args.memo else {}
+    if args.short_circuit:
+        options["short_circuit"] = True
+    # time everything before counting: the instrumented subclass deoptimizes shared call sites
+    timings = {name: time_program(interpreter_lib, PROGRAMS[name], args.repeats,
+                                  **program_options(interpreter_lib, name, options))
+               for name in args.programs}
+
+    print(f"{'program':<16}{'statements':>12}{'best (s)':>12}{'stmts/s':>14}")
+    for name in args.programs:
+        statements = count_statements(counting_lib, PROGRAMS[name], **program_options(counting_lib, name, options))
+        best = timings[name]
+        print(f"{name:<16}{statements:>12}{best:>12.4f}{statements / best:>14.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Parser throughput benchmark.
+
+Parses programs from brewgen of growing size and reports, for the lexer alone and for every parser
+backend (lexing included), tokens per second, AST nodes per second, megabytes per second and peak
+traced memory, followed by the growth exponent of parse time in program size (about 1 for linear).
+
+usage: python3 parsebench.py [-n REPEATS] [--sizes SIZE,...] [--no-memory] [BACKEND ...]
+
+Sizes take K and M suffixes (1K = 1000 bytes); 100M works but takes minutes and several GB.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from ply import lex
+
+from brewanalyze import walk
+from brewgen import generate_program
+from brewparse import parse_program
+from scalebench import growth_exponent
+
+# Parser backends: name -> function from source text to the program's AST. PLY (brewlex + brewparse)
+# is the baseline every other backend is compared against.
+BACKENDS = {
+    "ply": parse_program,
+}
+BASELINE = "ply"
+
+DEFAULT_SIZES = "1K,10K,100K,1M,10M"
+SIZE_SUFFIXES = {"K": 1000, "M": 1000 ** 2}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1:] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def lex_all(source):
+    """Run brewlex over the whole source; return the number of tokens."""
+    lexer = lex.lexer.clone()
+    lexer.input(source)
+    return sum(1 for _ in iter(lexer.token, None))
+
+
+def best_time(func, source, repeats):
+    """Best wall time of func(source) over repeats runs with GC paused; also returns the last result."""
+    best = None
+    result = None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func(source)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func, source):
+    """Peak traced memory in bytes while running func(source)."""
+    tracemalloc.start()
+    try:
+        func(source)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brewin parser throughput benchmark")
+    parser.add_argument("-n", "--repeats", type=int, default=3,
+                        help="runs per measurement (programs of 10 MB and more run once)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated program sizes in bytes")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("backends", nargs="*", default=list(BACKENDS))
+    args = parser.parse_args()
+
+    stages = [("lex", lex_all)] + [(name, BACKENDS[name]) for name in args.backends]
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    times = {name: [] for name, _ in stages}
+    actual_sizes = []
+
+    print(f"{'stage':<8}{'bytes':>12}{'tokens':>11}{'nodes':>11}{'time (s)':>10}{'MB/s':>8}"
+          f"{'tokens/s':>12}{'nodes/s':>12}{'peak MB':>9}")
+    for size in sizes:
+        source, _ = generate_program(seed=size, size=size)
+        actual_sizes.append(len(source))
+        repeats = 1 if len(source) >= 10 * SIZE_SUFFIXES["M"] else args.repeats
+        tokens = lex_all(source)
+        nodes = None
+        for name, func in stages:
+            elapsed, result = best_time(func, source, repeats)
+            times[name].append(elapsed)
+            if name != "lex":
+                nodes = sum(1 for _ in walk(result))
+            result = None
+            peak = None if args.no_memory else peak_memory(func, source) / 1e6
+            print(f"{name:<8}{len(source):>12}{tokens:>11}{nodes if name != 'lex' else '-':>11}{elapsed:>10.3f}"
+                  f"{len(source) / 1e6 / elapsed:>8.2f}{tokens / elapsed:>12.0f}"
+                  f"{(f'{nodes / elapsed:.0f}' if name != 'lex' else '-'):>12}"
+                  f"{(f'{peak:.1f}' if peak is not None else '-'):>9}")
+
+    if len(actual_sizes) > 1:
+        print()
+        for name, _ in stages:
+            exponent = growth_exponent(actual_sizes, times[name])
+            relative = ""
+            if name not in ["lex", BASELINE] and BASELINE in times:
+                ratio = sum(times[name]) / sum(times[BASELINE])
+                relative = f", {ratio:.2f}x the time of {BASELINE}"
+            print(f"{name}: time grows as size^{exponent:.2f}{relative}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Scaling benchmarks for the Brewin interpreters.
+
+Each sweep generates programs that run the same fixed number of operations while one dimension of the
+program state grows: recursion depth, block nesting, number of functions, number of live closures and
+proto-chain length. The cost per operation is the difference between a run with the operations and one
+without (same setup), divided by their number. A least-squares fit of log(cost) against log(size)
+gives the growth exponent: about 0 when an operation's cost does not depend on the state, about 1 when
+it is linear in it. Sweeps growing faster than expected are flagged.
+
+usage: python3 scalebench.py [-m MODULE] [-n REPEATS] [--ops OPS] [--fail-on-growth] [SWEEP ...]
+"""
+
+import argparse
+import importlib
+import math
+import sys
+
+from microbench import time_program
+
+# Exponents below CONSTANT_EXPONENT count as constant per-operation cost, below LINEAR_EXPONENT as linear
+CONSTANT_EXPONENT = 0.25
+LINEAR_EXPONENT = 1.25
+GROWTH_CLASSES = ["constant", "linear", "super-linear"]
+
+
+def recursion_depth(size, ops):
+    """Reads of main's variables from the bottom of a recursion size calls deep."""
+    return f"""
+func work(d) {{
+  if (d > 0) {{
+    return work(d - 1);
+  }}
+  i = 0;
+  while (i < {ops}) {{
+    s = s + g;
+    i = i + 1;
+  }}
+  return s;
+}}
+
+func main() {{
+  g = 1;
+  s = 0;
+  print(work({size}));
+}}
+"""
+
+
+def scope_nesting(size, ops):
+    """Reads of main's variables from inside size nested blocks."""
+    opening = "  if (true) {\n" * size
+    closing = "  }\n" * size
+    return f"""
+func main() {{
+  g = 1;
+  s = 0;
+  i = 0;
+{opening}  while (i < {ops}) {{
+    s = s + g;
+    i = i + 1;
+  }}
+{closing}  print(s);
+}}
+"""
+
+
+def function_count(size, ops):
+    """Calls to one of size top-level functions."""
+    functions = "".join(f"func f{k}(x) {{\n  return x + {k};\n}}\n\n" for k in range(size))
+    return f"""
+{functions}func main() {{
+  s = 0;
+  i = 0;
+  while (i < {ops}) {{
+    s = s + f{size - 1}(i);
+    i = i + 1;
+  }}
+  print(s);
+}}
+"""
+
+
+def closure_count(size, ops):
+    """Creating and calling a closure while size other closures are live in the same scope."""
+    closures = "".join(f"  c{k} = lambda(x) {{ return x + {k}; }};\n" for k in range(size))
+    return f"""
+func main() {{
+  g = 1;
+{closures}  s = 0;
+  i = 0;
+  while (i < {ops}) {{
+    f = lambda(x) {{ return x + g; }};
+    s = s + f(i);
+    i = i + 1;
+  }}
+  print(s);
+}}
+"""
+
+
+def proto_chain(size, ops):
+    """Reads of a field defined at the end of a proto chain of size objects."""
+    return f"""
+func main() {{
+  base = @;
+  base.value = 1;
+  top = base;
+  k = 0;
+  while (k < {size}) {{
+    next = @;
+    next.proto = top;
+    top = next;
+    k = k + 1;
+  }}
+  s = 0;
+  i = 0;
+  while (i < {ops}) {{
+    s = s + top.value;
+    i = i + 1;
+  }}
+  print(s);
+}}
+"""
+
+
+# name: (program generator, sizes, expected growth class of the per-operation cost)
+SWEEPS = {
+    "recursion_depth": (recursion_depth, [10, 25, 50, 100, 200], "constant"),
+    "scope_nesting": (scope_nesting, [1, 4, 16, 64, 128], "constant"),
+    "function_count": (function_count, [1, 10, 100, 1000], "constant"),
+    "closure_count": (closure_count, [1, 10, 100, 400], "constant"),
+    "proto_chain": (proto_chain, [1, 4, 16, 64, 128], "linear"),
+}
+
+
+def cost_per_op(interpreter_lib, generator, size, ops, repeats):
+    """Seconds per operation at the given size: the time the operations add to the program's setup."""
+    with_ops = time_program(interpreter_lib, generator(size, ops), repeats)
+    setup_only = time_program(interpreter_lib, generator(size, 0), repeats)
+    return max(with_ops - setup_only, 1e-12) / ops
+
+
+def growth_exponent(sizes, costs):
+    """Least-squares slope of log(cost) against log(size)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(cost) for cost in costs]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+def growth_class(exponent):
+    if exponent < CONSTANT_EXPONENT:
+        return "constant"
+    if exponent < LINEAR_EXPONENT:
+        return "linear"
+    return "super-linear"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brewin interpreter scaling benchmarks")
+    parser.add_argument("-m", "--module", default="interpreterv4")
+    parser.add_argument("-n", "--repeats", type=int, default=3)
+    parser.add_argument("--ops", type=int, default=2000, help="operations per measured run")
+    parser.add_argument("--fail-on-growth", action="store_true",
+                        help="exit with status 1 if a sweep grows faster than expected")
+    parser.add_argument("sweeps", nargs="*", default=list(SWEEPS))
+    args = parser.parse_args()
+
+    interpreter_lib = importlib.import_module(args.module)
+    # the deepest recursion sweep nests a few Python frames per Brewin call
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    flagged = []
+    print(f"{'sweep':<18}{'size':>8}{'ns/op':>12}")
+    for name in args.sweeps:
+        generator, sizes, expected = SWEEPS[name]
+        costs = [cost_per_op(interpreter_lib, generator, size, args.ops, args.repeats) for size in sizes]
+        for size, cost in zip(sizes, costs):
+            print(f"{name:<18}{size:>8}{cost * 1e9:>12.0f}")
+        exponent = growth_exponent(sizes, costs)
+        measured = growth_class(exponent)
+        grows = GROWTH_CLASSES.index(measured) > GROWTH_CLASSES.index(expected)
+        if grows:
+            flagged.append(name)
+        print(f"{'':<18}growth: size^{exponent:.2f} ({measured}, expected {expected})"
+              f"{'  <-- grows faster than expected' if grows else ''}")
+
+    if flagged:
+        print(f"Faster than expected growth: {', '.join(flagged)}")
+        if args.fail_on_growth:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()